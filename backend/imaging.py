@@ -0,0 +1,116 @@
+# Image loading
+# Every pixel decode goes through load_image, so sources are only decoded at
+# the resolution their output needs; headers are read without decoding pixels.
+import base64
+import binascii
+import io
+
+from PIL import Image, ImageCms, ImageOps, ExifTags
+
+from metrics import timed
+
+HEADER_PARSE_LIMIT = 512 * 1024  # give up on incremental header parsing after this many bytes
+
+def pixel_size(width, height, dpi):
+    """Pixel size of a width x height point box at `dpi`."""
+    return max(1, round(width / 72 * dpi)), max(1, round(height / 72 * dpi))
+
+def load_image(source, target_size=None):
+    """Decode an image upright, in RGB, RGBA, L or LA mode.
+
+    `source` is a path or encoded bytes. With a `target_size` (width, height)
+    in upright pixels, the image is decoded at the smallest scale that still
+    covers it: JPEGs through DCT scaling (draft), other formats by an integer
+    reduce straight after decoding. Without one it is decoded at full size.
+    """
+    with timed('image_decode'):
+        img = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+        try:
+            if target_size:
+                width, height = target_size
+                if img.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+                    width, height = height, width
+                img.draft(img.mode, (width, height))
+            # Single-frame files release their file handle once decoded
+            img.load()
+        except Exception:
+            img.close()
+            raise
+        
+        if target_size:
+            factor = min(img.width // width, img.height // height)
+            if factor >= 2:
+                img = img.reduce(factor)
+        ImageOps.exif_transpose(img, in_place=True)
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+    return img
+
+def decode_pixels(width, height, target_size=None, image_format='JPEG'):
+    """Peak pixels load_image decodes for a width x height source at `target_size`.
+
+    Only JPEGs are scaled during decode; other formats are reduced afterwards.
+    """
+    if not target_size or image_format not in ('JPEG', 'MPO'):
+        return width * height
+    factor = max(1, min(width // max(1, target_size[0]), height // max(1, target_size[1])))
+    return (width // factor) * (height // factor)
+
+def is_srgb_profile(icc_profile):
+    try:
+        profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        return 'srgb' in (profile.profile.profile_description or '').lower()
+    except (ImageCms.PyCMSError, OSError, TypeError):
+        return False
+
+def _image_header(img, orientation=1):
+    icc_profile = img.info.get('icc_profile')
+    return {
+        "width": img.width,
+        "height": img.height,
+        "format": img.format,
+        "orientation": orientation,
+        "mode": img.mode,
+        "foreign_profile": bool(icc_profile) and not is_srgb_profile(icc_profile),
+    }
+
+def parse_image_header(data):
+    """Read dimensions, format, mode, colour profile and EXIF orientation from the leading bytes of an image.
+
+    Image.open only reads headers, so no pixel data is decoded. Returns None
+    when the bytes do not (yet) contain a complete header.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            orientation = 1
+            # JPEG carries EXIF in its header; other formats may store it after the pixels
+            if img.format in ('JPEG', 'MPO'):
+                orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+            return _image_header(img, orientation)
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+def read_image_header(file_path):
+    """Like parse_image_header, for a complete file; EXIF orientation is read wherever it is stored."""
+    try:
+        with Image.open(file_path) as img:
+            return _image_header(img, img.getexif().get(ExifTags.Base.Orientation, 1))
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+def data_url_header(data_url):
+    """Image header of a base64 data URL, or None if it is not a readable image.
+
+    Only the leading part of the payload is decoded unless the header lies
+    beyond HEADER_PARSE_LIMIT. Raises DecompressionBombError for images far
+    over the pixel limit.
+    """
+    encoded = data_url.split(',', 1)[-1]
+    try:
+        header = parse_image_header(base64.b64decode(encoded[:HEADER_PARSE_LIMIT // 3 * 4]))
+        if header is None and len(encoded) > HEADER_PARSE_LIMIT // 3 * 4:
+            header = parse_image_header(base64.b64decode(encoded))
+    except binascii.Error:
+        return None
+    return header
@@ -0,0 +1,109 @@
+# Metrics
+# Served in the Prometheus text format at /metrics: latency and body bytes
+# per route, time spent in each processing stage and Mongo round trips.
+# Stages can nest (a PDF draw includes the image decodes inside it). Stages
+# that run in a process worker pool are not recorded; the pool's job timings
+# still are.
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status'),
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_BYTES = Counter('http_request_bytes_total', 'Request body bytes received by route', ('method', 'route'))
+RESPONSE_BYTES = Counter('http_response_bytes_total', 'Response body bytes sent by route', ('method', 'route'))
+STAGE_SECONDS = Histogram(
+    'collage_stage_duration_seconds', 'Time spent in each processing stage', ('stage',), buckets=LATENCY_BUCKETS
+)
+WORKER_JOB_SECONDS = Histogram(
+    'collage_worker_job_duration_seconds', 'Worker pool jobs from submission to completion', ('function',),
+    buckets=LATENCY_BUCKETS
+)
+MONGO_SECONDS = Histogram(
+    'collage_mongo_command_duration_seconds', 'Mongo command round trips', ('command',), buckets=LATENCY_BUCKETS
+)
+
+def timed(stage):
+    """Context manager recording the time spent in a processing stage."""
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+class MongoCommandTimer(monitoring.CommandListener):
+    def started(self, event):
+        pass
+    
+    def succeeded(self, event):
+        MONGO_SECONDS.labels(command=event.command_name).observe(event.duration_micros / 1e6)
+    
+    def failed(self, event):
+        MONGO_SECONDS.labels(command=event.command_name).observe(event.duration_micros / 1e6)
+
+class MetricsMiddleware:
+    """Records latency and body bytes of every HTTP request, labelled with its route template."""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        
+        started = time.perf_counter()
+        received = 0
+        sent = 0
+        status = 500
+        
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+            return message
+        
+        async def counting_send(message):
+            nonlocal sent, status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            await send(message)
+        
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            # The router stores the matched route in the scope; raw paths would explode label cardinality
+            route = scope.get('route')
+            route = getattr(route, 'path', 'unmatched')
+            method = scope['method']
+            REQUEST_SECONDS.labels(method=method, route=route, status=status).observe(time.perf_counter() - started)
+            REQUEST_BYTES.labels(method=method, route=route).inc(received)
+            RESPONSE_BYTES.labels(method=method, route=route).inc(sent)
+
+class ComponentStatsCollector:
+    """Exports the numeric fields of component stats() dicts as collage_<component>_<field> gauges.
+
+    `components` maps a component name to a callable returning its stats,
+    read at scrape time.
+    """
+    
+    def __init__(self, components):
+        self.components = components
+    
+    def collect(self):
+        for component, stats in self.components.items():
+            for field, value in stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"collage_{component}_{field}"
+                    yield GaugeMetricFamily(name, f"{field} of the {component} component", value=value)
+
+def register_component_stats(components):
+    REGISTRY.register(ComponentStatsCollector(components))
+
+def render_metrics():
+    """The default registry in the Prometheus text format, with its content type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,29 +1,59 @@
-from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException, BackgroundTasks, Query, Request, Response
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from dotenv import load_dotenv
+from starlette.background import BackgroundTask
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
 from datetime import datetime, timezone
-from PIL import Image, ImageFilter, ImageEnhance, ImageOps
-from reportlab.lib.pagesizes import A4
+from PIL import Image, ImageFilter, ImageEnhance, ImageOps, ImageCms, ExifTags
+from reportlab.lib.pagesizes import A3, A4, letter, landscape, portrait
+from reportlab.lib.units import inch, mm
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
+from reportlab import rl_config
 import io
+import json
+import mimetypes
 import base64
-import shutil
+import hashlib
+import time
+import zipfile
+import anyio
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import tempfile
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from imaging import (
+    HEADER_PARSE_LIMIT, data_url_header, decode_pixels, is_srgb_profile, load_image, parse_image_header,
+    pixel_size, read_image_header,
+)
+from metrics import (
+    STAGE_SECONDS, WORKER_JOB_SECONDS, MetricsMiddleware, MongoCommandTimer, register_component_stats,
+    render_metrics, timed,
+)
+from storage_backends import (
+    LETTERHEAD_PREFIX, PDF_PREFIX, PHOTO_PREFIX, create_storage, object_key,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandTimer()])
 db = client[os.environ['DB_NAME']]
 
 # Create upload directories
@@ -31,10 +61,488 @@ UPLOAD_DIR = ROOT_DIR / 'uploads'
 PHOTO_DIR = UPLOAD_DIR / 'photos'
 LETTERHEAD_DIR = UPLOAD_DIR / 'letterheads'
 PDF_DIR = UPLOAD_DIR / 'pdfs'
+CACHE_DIR = UPLOAD_DIR / 'cache'
 
-for directory in [UPLOAD_DIR, PHOTO_DIR, LETTERHEAD_DIR, PDF_DIR]:
+for directory in [UPLOAD_DIR, PHOTO_DIR, LETTERHEAD_DIR, PDF_DIR, CACHE_DIR]:
     directory.mkdir(exist_ok=True, parents=True)
 
+# Storage backends (storage_backends.py); the upload directories above stay
+# as node-local staging space.
+storage = create_storage(UPLOAD_DIR, UPLOAD_DIR / 'object-cache')
+
+# Memory admission control
+# Work that decodes pixels reserves an estimate of its decoded size up front;
+# it waits while the budget is exhausted and is rejected rather than risking
+# an out-of-memory kill.
+BYTES_PER_PIXEL = 4
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 100_000_000))
+MAX_UPLOAD_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', 100)) * 1024 * 1024)
+
+# Decompression bombs: refuse to open anything over the pixel limit at all
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+def available_memory():
+    """Memory available to this process: the cgroup limit when set, else physical RAM."""
+    limits = []
+    try:
+        limits.append(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+    except (ValueError, OSError, AttributeError):
+        pass
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            value = Path(path).read_text().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            limits.append(int(value))
+    return min(limits) if limits else 2 * 1024 ** 3
+
+class MemoryBudget:
+    """Weighted semaphore over the estimated memory of in-flight decodes.
+
+    A reservation larger than `request_limit` is rejected with 413; otherwise
+    it waits until it fits in `capacity`, and fails with 503 after
+    `wait_timeout` seconds unless acquired with `wait`.
+    """
+    
+    def __init__(self, capacity, request_limit, wait_timeout=30.0):
+        self.capacity = capacity
+        self.request_limit = min(request_limit, capacity)
+        self.wait_timeout = wait_timeout
+        self.in_use = 0
+        self.peak = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._condition = None
+    
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+    
+    async def acquire(self, nbytes, wait=False):
+        if nbytes > self.request_limit:
+            self.rejected += 1
+            raise HTTPException(status_code=413, detail="Request exceeds the image memory budget")
+        condition = self._get_condition()
+        async with condition:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self.in_use + nbytes <= self.capacity),
+                    None if wait else self.wait_timeout
+                )
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503, detail="Server is low on memory, please retry shortly",
+                    headers={"Retry-After": "5"}
+                )
+            finally:
+                self.waiting -= 1
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+            self.admitted += 1
+    
+    def release(self, nbytes):
+        # Runs on the event loop thread
+        self.in_use -= nbytes
+        asyncio.get_running_loop().create_task(self._notify())
+    
+    async def _notify(self):
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+    
+    def stats(self):
+        return {
+            "capacity_bytes": self.capacity,
+            "request_limit_bytes": self.request_limit,
+            "in_use_bytes": self.in_use,
+            "peak_bytes": self.peak,
+            "utilization": round(self.in_use / self.capacity, 4) if self.capacity else 0,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+memory_budget = MemoryBudget(
+    capacity=int(float(os.environ.get('MEMORY_BUDGET_MB', 0)) * 1024 * 1024)
+    or int(available_memory() * float(os.environ.get('MEMORY_BUDGET_FRACTION', 0.5))),
+    request_limit=int(os.environ.get('REQUEST_PIXEL_BUDGET', 200_000_000)) * BYTES_PER_PIXEL,
+    wait_timeout=float(os.environ.get('MEMORY_WAIT_TIMEOUT', 30)),
+)
+
+# Worker pool for Pillow and ReportLab work
+class WorkerPool:
+    """Bounded executor that keeps CPU-heavy image and PDF jobs off the event loop.
+
+    At most `queue_limit` jobs may be running or waiting at once; further
+    submissions are rejected with 429 instead of piling up, unless they ask
+    to `wait` for a slot. Jobs that exceed `timeout` seconds fail the request
+    with 504.
+    """
+    
+    def __init__(self, kind='thread', size=None, queue_limit=None, timeout=120.0):
+        self.kind = kind
+        self.size = size or os.cpu_count() or 2
+        self.queue_limit = queue_limit or self.size * 4
+        self.timeout = timeout
+        self.pending = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._executor = None
+        self._condition = None
+    
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                # spawn avoids forking the event loop and Mongo client threads
+                self._executor = ProcessPoolExecutor(self.size, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self._executor = ThreadPoolExecutor(self.size, thread_name_prefix='worker')
+        return self._executor
+    
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+    
+    def _release_slot(self):
+        # Runs on the event loop thread
+        self.pending -= 1
+        if self.waiting:
+            asyncio.get_running_loop().create_task(self._notify())
+    
+    async def _notify(self):
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+    
+    async def _wait_for_slot(self):
+        condition = self._get_condition()
+        async with condition:
+            self.waiting += 1
+            try:
+                await condition.wait_for(lambda: self.pending < self.queue_limit)
+            finally:
+                self.waiting -= 1
+    
+    def _job_done(self, future, memory, name, started):
+        WORKER_JOB_SECONDS.labels(function=name).observe(time.perf_counter() - started)
+        self._release_slot()
+        if memory:
+            memory_budget.release(memory)
+        if not future.cancelled():
+            self.completed += 1
+    
+    async def run(self, fn, *args, timeout=None, pixels=0, wait=False, on_admitted=None, **kwargs):
+        """Run `fn` in the pool; `pixels` is the estimated decode size reserved from the memory budget.
+
+        With `wait`, a full queue or memory budget is waited out instead of
+        failing the call. `on_admitted()` is awaited once the job holds its
+        slot and memory, just before it is submitted.
+        """
+        if self.pending >= self.queue_limit:
+            if not wait:
+                self.rejected += 1
+                raise HTTPException(status_code=429, detail="Server is busy, please retry shortly", headers={"Retry-After": "1"})
+            await self._wait_for_slot()
+        # Counted from here, so requests waiting on the memory budget take up queue slots too
+        self.pending += 1
+        memory = pixels * BYTES_PER_PIXEL
+        reserved = 0
+        
+        # The slot and memory are held until the job really finishes, even if the request times out
+        loop = asyncio.get_running_loop()
+        name = getattr(fn, '__name__', 'job')
+        try:
+            if memory:
+                await memory_budget.acquire(memory, wait=wait)
+                reserved = memory
+            if on_admitted:
+                await on_admitted()
+            started = time.perf_counter()
+            job = self._get_executor().submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release_slot()
+            if reserved:
+                memory_budget.release(reserved)
+            raise
+        job.add_done_callback(
+            lambda future: loop.call_soon_threadsafe(self._job_done, future, memory, name, started)
+        )
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            job.cancel()
+            raise HTTPException(status_code=504, detail="Processing timed out")
+    
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "size": self.size,
+            "queue_limit": self.queue_limit,
+            "pending": self.pending,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+    
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+worker_pool = WorkerPool(
+    kind=os.environ.get('WORKER_POOL_KIND', 'thread'),
+    size=int(os.environ.get('WORKER_POOL_SIZE', 0)) or None,
+    queue_limit=int(os.environ.get('WORKER_QUEUE_LIMIT', 0)) or None,
+    timeout=float(os.environ.get('WORKER_JOB_TIMEOUT', 120)),
+)
+
+# Render cache for edited images and layout tiles
+class RenderCache:
+    """Two-tier cache of rendered image bytes.
+
+    Entries are kept in an in-memory LRU bounded by `memory_bytes` and in
+    `directory` on disk, bounded by `disk_bytes`. On overflow the disk tier
+    drops the least recently used files (by mtime, refreshed on each hit).
+    Safe to use from worker threads.
+    """
+    
+    def __init__(self, directory, memory_bytes, disk_bytes):
+        self.directory = Path(directory)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    
+    def _disk_path(self, key):
+        return self.directory / key[:2] / key
+    
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+                self.evictions += 1
+    
+    def get(self, key, memory_only=False):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+        if memory_only:
+            return None
+        
+        path = self._disk_path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(key, data)
+        return data
+    
+    def put(self, key, data):
+        self._remember(key, data)
+        path = self._disk_path(key)
+        path.parent.mkdir(exist_ok=True)
+        temp_path = path.with_name(f".{key}.{uuid.uuid4().hex}")
+        temp_path.write_bytes(data)
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan_disk_size()
+            else:
+                self._disk_size += len(data) - replaced
+            overflow = self._disk_size > self.disk_bytes
+        if overflow:
+            self._evict_disk()
+    
+    def _disk_entries(self):
+        """(mtime, size, path) of every cached file; files removed while scanning are skipped."""
+        entries = []
+        for path in self.directory.glob('*/*'):
+            if path.name.startswith('.'):
+                continue  # still being written by put()
+            try:
+                stat_result = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat_result.st_mtime, stat_result.st_size, path))
+        return entries
+    
+    def _scan_disk_size(self):
+        return sum(size for _, size, _ in self._disk_entries())
+    
+    def _evict_disk(self):
+        """Delete least recently used files until the disk tier is at 90% of its budget."""
+        # One eviction at a time; puts arriving meanwhile leave it to the running one,
+        # which goes round again if they pushed the tier back over budget
+        while self._evict_lock.acquire(blocking=False):
+            try:
+                with self._lock:
+                    counted = self._disk_size
+                entries = sorted(self._disk_entries())
+                total = sum(size for _, size, _ in entries)
+                target = self.disk_bytes * 0.9
+                for _, size, path in entries:
+                    if total <= target:
+                        break
+                    path.unlink(missing_ok=True)
+                    total -= size
+                    with self._lock:
+                        self.evictions += 1
+                with self._lock:
+                    # Resync with what is on disk, keeping puts that landed during the scan
+                    self._disk_size = total + self._disk_size - counted
+                    if self._disk_size <= self.disk_bytes:
+                        return
+            finally:
+                self._evict_lock.release()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "memory_limit": self.memory_bytes,
+                "disk_bytes": self._disk_size,
+                "disk_limit": self.disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+render_cache = RenderCache(
+    CACHE_DIR,
+    memory_bytes=int(os.environ.get('RENDER_CACHE_MEMORY_MB', 256)) * 1024 * 1024,
+    disk_bytes=int(os.environ.get('RENDER_CACHE_DISK_MB', 2048)) * 1024 * 1024,
+)
+
+# Metadata cache for file-serving lookups
+class MetadataCache:
+    """TTL/LRU cache of documents from one collection, keyed by their `id`.
+
+    Concurrent misses for the same id share a single query. Writers call
+    `invalidate` after changing a document; a lookup already in flight for
+    that id is then not cached. Cached documents are shared between callers
+    and must not be mutated. Writes made by other processes become visible
+    once an entry expires. Used from the event loop only.
+    """
+    
+    def __init__(self, collection_name, ttl, max_entries):
+        self.collection_name = collection_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # id -> (expires_at, document)
+        self._pending = {}  # id -> task loading it
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+    
+    async def get(self, doc_id):
+        """The document with `doc_id`, or None if there is none."""
+        entry = self._entries.get(doc_id)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(doc_id)
+            self.hits += 1
+            return entry[1]
+        
+        task = self._pending.get(doc_id)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(doc_id))
+            self._pending[doc_id] = task
+        else:
+            self.coalesced += 1
+        # Shielded, so a cancelled caller does not fail the others waiting on it
+        return await asyncio.shield(task)
+    
+    async def _load(self, doc_id):
+        task = asyncio.current_task()
+        try:
+            document = await db[self.collection_name].find_one({"id": doc_id}, {"_id": 0})
+        finally:
+            current = self._pending.get(doc_id) is task
+            if current:
+                del self._pending[doc_id]
+        if document is not None and current and self.ttl > 0:
+            self._entries[doc_id] = (time.monotonic() + self.ttl, document)
+            self._entries.move_to_end(doc_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return document
+    
+    def invalidate(self, *doc_ids):
+        for doc_id in doc_ids:
+            self._entries.pop(doc_id, None)
+            self._pending.pop(doc_id, None)
+    
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+METADATA_CACHE_TTL = float(os.environ.get('METADATA_CACHE_TTL', 30))
+METADATA_CACHE_ENTRIES = int(os.environ.get('METADATA_CACHE_ENTRIES', 10000))
+photo_cache = MetadataCache('photos', METADATA_CACHE_TTL, METADATA_CACHE_ENTRIES)
+letterhead_cache = MetadataCache('letterheads', METADATA_CACHE_TTL, METADATA_CACHE_ENTRIES)
+
+def encode_image(img):
+    """Encode a rendered image: PNG when it has transparency, JPEG otherwise."""
+    buffer = io.BytesIO()
+    with timed('image_encode'):
+        if 'A' in img.getbands() or 'transparency' in img.info:
+            img.save(buffer, 'PNG')
+        else:
+            img.convert('RGB').save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+def image_media_type(data):
+    return 'image/png' if data.startswith(b'\x89PNG') else 'image/jpeg'
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -42,25 +550,49 @@ app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # Define Models
+class ImageOperation(BaseModel):
+    operation: str  # one of IMAGE_OPERATIONS
+    value: Optional[float] = None
+
 class PhotoMetadata(BaseModel):
     model_config = ConfigDict(extra="ignore")
     
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     filename: str
     original_filename: str
-    file_path: str
+    storage_key: str  # object key of the stored file
     width: int
     height: int
     size: int
+    format: Optional[str] = None
+    orientation: int = 1  # EXIF orientation of the stored file
+    original_width: Optional[int] = None  # dimensions as uploaded, before normalization
+    original_height: Optional[int] = None
+    content_hash: Optional[str] = None  # sha256 of the stored blob, shared by duplicate uploads
+    renditions: Dict[str, str] = {}  # rendition_key -> filename in PHOTO_DIR
+    edits: List[ImageOperation] = []  # non-destructive edit recipe, applied in order
+    edit_key: Optional[str] = None  # render cache key of the edited result
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class PhotoUploadResult(BaseModel):
+    filename: Optional[str] = None
+    photo: Optional[PhotoMetadata] = None
+    error: Optional[str] = None  # set when the file was rejected
+
+class PhotoDeleteRequest(BaseModel):
+    photo_ids: List[str]
+
+class PhotoDeleteResult(BaseModel):
+    deleted: List[str] = []
+    not_found: List[str] = []
+
 class LetterheadMetadata(BaseModel):
     model_config = ConfigDict(extra="ignore")
     
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     filename: str
-    file_path: str
+    storage_key: str  # object key of the stored file
     is_default: bool = False
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -73,77 +605,938 @@ class CollageProject(BaseModel):
     letterhead_id: Optional[str] = None
     photo_ids: List[str] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    pdf_path: Optional[str] = None
+    pdf_key: Optional[str] = None  # object key of the last exported PDF
 
 class ImageProcessRequest(BaseModel):
     image_data: str  # base64 encoded image
     operation: str  # 'rotate', 'brightness', 'contrast', 'blur', 'sharpen', 'grayscale'
     value: Optional[float] = None
 
+class PhotoEditRequest(BaseModel):
+    operations: List[ImageOperation]  # applied in order to the original photo
+
 class PDFGenerateRequest(BaseModel):
     project_id: str
-    images: List[dict]  # [{id, data, x, y, width, height}]
+    images: List[dict] = []  # [{id, data, x, y, width, height}]
     letterhead_id: Optional[str] = None
+    # Server-side rendering: when layout is set, photo_ids are placed by the layout engine
+    layout: Optional[str] = None  # one of COLLAGE_LAYOUTS
+    photo_ids: List[str] = []
+    fit_mode: str = 'cover'  # 'cover' (fill) or 'contain' (fit)
+    page_size: str = 'A4'  # one of PAGE_SIZES
+    orientation: str = 'portrait'  # 'portrait' or 'landscape'
+    bleed_mm: float = Field(0, ge=0, le=10)  # extra image area around the trimmed page
+    quality: str = 'print'  # one of PDF_QUALITY_DPI
+    dpi: Optional[int] = Field(None, ge=36, le=1200)  # overrides the quality preset
+    # Book export: paginate every photo (default: the project's photo_ids) across layout pages
+    book: bool = False
+    stream: bool = False  # send the PDF in the response body instead of storing it under uploads/pdfs
 
-# Upload photo endpoint
-@api_router.post("/photos/upload", response_model=PhotoMetadata)
-async def upload_photo(file: UploadFile = File(...)):
+class PDFJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    project_id: str
+    status: str = 'queued'  # 'queued', 'running', 'done', 'failed'
+    progress: Dict[str, int] = {"done": 0, "total": 0}  # images placed so far
+    pdf_url: Optional[str] = None
+    size: Optional[int] = None  # bytes
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+
+# Collage layouts, mirroring layoutTemplates in CollageEditor.jsx.
+# Each cell is (col, row, col_span, row_span) in photo order; gap and padding
+# are the Tailwind spacing of the editor grid converted to points (1px = 0.75pt).
+def _grid_cells(cols, rows):
+    return [(col, row, 1, 1) for row in range(rows) for col in range(cols)]
+
+COLLAGE_LAYOUTS = {
+    '2x2': {'cols': 2, 'rows': 2, 'cells': _grid_cells(2, 2), 'gap': 4.5, 'padding': 6},
+    '3x3': {'cols': 3, 'rows': 3, 'cells': _grid_cells(3, 3), 'gap': 3, 'padding': 4.5},
+    '4x4': {'cols': 4, 'rows': 4, 'cells': _grid_cells(4, 4), 'gap': 1.5, 'padding': 4.5},
+    '2x3': {'cols': 2, 'rows': 3, 'cells': _grid_cells(2, 3), 'gap': 4.5, 'padding': 6},
+    '3x2': {'cols': 3, 'rows': 2, 'cells': _grid_cells(3, 2), 'gap': 4.5, 'padding': 6},
+    'portrait': {'cols': 2, 'rows': 4, 'cells': _grid_cells(2, 4), 'gap': 3, 'padding': 6},
+    'landscape': {'cols': 4, 'rows': 2, 'cells': _grid_cells(4, 2), 'gap': 3, 'padding': 6},
+    '1-large-landscape': {
+        'cols': 2, 'rows': 2,
+        'cells': [(0, 0, 1, 2), (1, 0, 1, 1), (1, 1, 1, 1)],
+        'gap': 4.5, 'padding': 6,
+    },
+    '1-large-portrait': {
+        'cols': 2, 'rows': 2,
+        'cells': [(0, 0, 2, 1), (0, 1, 1, 1), (1, 1, 1, 1)],
+        'gap': 4.5, 'padding': 6,
+    },
+    # The fifth photo is the large tile, ordered first in the grid
+    '4-small-1-large': {
+        'cols': 4, 'rows': 2,
+        'cells': [(2, 0, 1, 1), (3, 0, 1, 1), (2, 1, 1, 1), (3, 1, 1, 1), (0, 0, 2, 2)],
+        'gap': 4.5, 'padding': 6,
+    },
+}
+
+# Page stock for exports, in points (portrait)
+PAGE_SIZES = {
+    'A4': A4,
+    'A3': A3,
+    'Letter': letter,
+    '4x6': (4 * inch, 6 * inch),
+    '5x7': (5 * inch, 7 * inch),
+}
+
+# Letterhead band on A4; other pages scale it with their short side
+LETTERHEAD_HEIGHT = 100
+CONTAIN_BACKGROUND = (249, 250, 251)  # bg-gray-50 behind fitted photos
+
+# Images are resampled to this resolution for the rectangle they are placed in
+PDF_QUALITY_DPI = {'screen': 150, 'print': 300}
+PDF_JPEG_QUALITY = 85
+
+# Write image and page streams as binary: ReportLab's ASCII85 wrapper is pure
+# Python and inflates every embedded image by a quarter.
+rl_config.useA85 = 0
+
+def page_geometry(page_size='A4', orientation='portrait', bleed_mm=0):
+    """Resolve a page stock and orientation into the trimmed page size, bleed and letterhead band, in points."""
+    size = PAGE_SIZES[page_size]
+    size = landscape(size) if orientation == 'landscape' else portrait(size)
+    return {
+        "page_size": size,
+        "bleed": bleed_mm * mm,
+        "letterhead_height": LETTERHEAD_HEIGHT * min(size) / min(A4),
+    }
+
+def compute_layout_slots(layout, page_width, page_height, top_offset=0):
+    """Return slot rectangles (x, y, width, height) in PDF points, bottom-left origin."""
+    spec = COLLAGE_LAYOUTS[layout]
+    cols, rows = spec['cols'], spec['rows']
+    gap, padding = spec['gap'], spec['padding']
+    
+    area_width = page_width - 2 * padding
+    area_height = page_height - top_offset - 2 * padding
+    cell_width = (area_width - gap * (cols - 1)) / cols
+    cell_height = (area_height - gap * (rows - 1)) / rows
+    
+    slots = []
+    for col, row, col_span, row_span in spec['cells']:
+        w = cell_width * col_span + gap * (col_span - 1)
+        h = cell_height * row_span + gap * (row_span - 1)
+        x = padding + col * (cell_width + gap)
+        top = top_offset + padding + row * (cell_height + gap)
+        slots.append((x, page_height - top - h, w, h))
+    return slots
+
+def contain_placement(slot_width, slot_height, image_width, image_height):
+    """Placement (dx, dy, width, height) of an image scaled to fit inside a slot."""
+    scale = min(slot_width / image_width, slot_height / image_height)
+    w, h = image_width * scale, image_height * scale
+    return (slot_width - w) / 2, (slot_height - h) / 2, w, h
+
+def fit_image_to_slot(img, slot_width, slot_height, fit_mode='cover', dpi=300):
+    """Crop (cover) or scale (contain) an image for a slot given in points.
+
+    The result is resampled to the slot's pixel size at `dpi`; images are
+    never upscaled.
+    """
+    target_width, target_height = pixel_size(slot_width, slot_height, dpi)
+    
+    if fit_mode == 'cover':
+        slot_ratio = slot_width / slot_height
+        if img.width / img.height > slot_ratio:
+            crop_width = round(img.height * slot_ratio)
+            left = (img.width - crop_width) // 2
+            img = img.crop((left, 0, left + crop_width, img.height))
+        else:
+            crop_height = round(img.width / slot_ratio)
+            top = (img.height - crop_height) // 2
+            img = img.crop((0, top, img.width, top + crop_height))
+        if img.width > target_width:
+            img = img.resize((target_width, target_height), Image.LANCZOS)
+        return img
+    
+    _, _, w, h = contain_placement(slot_width, slot_height, img.width, img.height)
+    pixel_width = max(1, round(w / 72 * dpi))
+    if img.width > pixel_width:
+        img = img.resize((pixel_width, max(1, round(h / 72 * dpi))), Image.LANCZOS)
+    return img
+
+def encode_for_pdf(img):
+    """Encode an image for embedding: JPEG (DCT) for photos, PNG (Flate) otherwise.
+
+    Transparency and flat graphics such as logos stay lossless; ReportLab
+    passes JPEG bytes through untouched and Flate-compresses the rest.
+    """
+    buffer = io.BytesIO()
+    has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+    if has_alpha or img.mode in ('1', 'P') or is_flat_graphic(img):
+        img.save(buffer, 'PNG', optimize=True)
+    else:
+        img.convert('L' if img.mode == 'L' else 'RGB').save(buffer, 'JPEG', quality=PDF_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+def is_flat_graphic(img):
+    """An RGB image with few colours, not all grey; greyscale photos easily fit in 256 levels."""
+    if img.mode != 'RGB':
+        return False
+    colors = img.getcolors(256)
+    return colors is not None and any(r != g or g != b for _, (r, g, b) in colors)
+
+def prepare_placed_image(source, width, height, dpi):
+    """Resample an image (path or bytes) to `dpi` for a width x height point box, preserving aspect ratio.
+
+    Returns the encoded image bytes.
+    """
+    img = load_image(source, pixel_size(width, height, dpi))
+    with timed('pdf_image_encode'):
+        return encode_for_pdf(fit_image_to_slot(img, width, height, 'contain', dpi))
+
+class PDFImageReader(ImageReader):
+    """ImageReader whose XObject name is derived from a content key.
+
+    ReportLab names image XObjects after an md5 of the decoded pixels, which
+    forces a full decode even for JPEGs it embeds verbatim. Returning the key
+    instead keeps JPEG embedding decode-free, and ReportLab reuses the XObject
+    whenever the same key is drawn again in a document.
+    """
+    def __init__(self, data, key):
+        super().__init__(io.BytesIO(data))
+        self.content_key = key
+        self._dataA = None
+    
+    def getRGBData(self):
+        if self.jpeg_fh():
+            return self.content_key.encode()
+        return super().getRGBData()
+
+class PDFImageSet:
+    """Per-document registry so each distinct image is embedded once.
+
+    ReportLab keeps the encoded streams until the document is saved (see
+    estimate_pdf_pixels); readers and their decoded pixels are dropped at the
+    end of each page unless kept.
+    """
+    def __init__(self):
+        self._readers = {}
+        self._kept = set()
+    
+    def reader(self, key, load, keep=False):
+        """Return the reader for `key`, calling `load()` for its bytes on first use."""
+        reader = self._readers.get(key)
+        if reader is None:
+            reader = self._readers[key] = PDFImageReader(load(), key)
+        if keep:
+            self._kept.add(key)
+        return reader
+    
+    def end_page(self):
+        self._readers = {key: reader for key, reader in self._readers.items() if key in self._kept}
+
+def layout_tile_key(photo, slot_width, slot_height, fit_mode='cover', dpi=300):
+    return RenderCache.make_key(
+        'tile', photo.get('content_hash') or photo['storage_key'], photo.get('edits') or [],
+        round(slot_width, 2), round(slot_height, 2), fit_mode, dpi
+    )
+
+def render_layout_tile(photo, slot_width, slot_height, fit_mode='cover', dpi=300):
+    """Encoded, fitted image for one layout slot, with the photo's edits applied.
+
+    Tiles are cached by photo content, edit recipe and output size.
+    """
+    key = layout_tile_key(photo, slot_width, slot_height, fit_mode, dpi)
+    data = render_cache.get(key)
+    if data is None:
+        img = load_edited_image(
+            storage.local_path(photo['storage_key']), photo.get('edits') or [],
+            pixel_size(slot_width, slot_height, dpi)
+        )
+        data = encode_for_pdf(fit_image_to_slot(img, slot_width, slot_height, fit_mode, dpi))
+        render_cache.put(key, data)
+    return data
+
+def prepare_letterhead(letterhead_key, width, height, dpi):
+    """Encoded letterhead band for a page, cached across requests.
+
+    Returns (key, bytes). Every letterhead upload gets a new object key, so
+    the key alone identifies its content.
+    """
+    key = RenderCache.make_key('letterhead', letterhead_key, round(width, 2), round(height, 2), dpi)
+    data = render_cache.get(key)
+    if data is None:
+        data = prepare_placed_image(storage.local_path(letterhead_key), width, height, dpi)
+        render_cache.put(key, data)
+    return key, data
+
+def draw_collage_layout(c, layout, photos, page_width, page_height, top_offset=0, fit_mode='cover', dpi=300,
+                        on_placed=None, image_set=None):
+    """Render stored photos into the slots of a collage layout.
+
+    `photos` are photo records (storage_key, content_hash, edits) in slot order;
+    `on_placed` is called after each slot is handled. Pass the document's
+    `image_set` so repeated tiles share one embedded image.
+    """
+    if image_set is None:
+        image_set = PDFImageSet()
+    slots = compute_layout_slots(layout, page_width, page_height, top_offset)
+    for (x, y, w, h), photo in zip(slots, photos):
+        try:
+            tile = image_set.reader(
+                layout_tile_key(photo, w, h, fit_mode, dpi),
+                functools.partial(render_layout_tile, photo, w, h, fit_mode, dpi)
+            )
+            if fit_mode == 'contain':
+                c.setFillColorRGB(*[v / 255 for v in CONTAIN_BACKGROUND])
+                c.rect(x, y, w, h, stroke=0, fill=1)
+                dx, dy, fw, fh = contain_placement(w, h, *tile.getSize())
+            else:
+                dx, dy, fw, fh = 0, 0, w, h
+            c.drawImage(tile, x + dx, y + dy, fw, fh, mask='auto')
+        except Exception as e:
+            logging.error(f"Error adding photo {photo['storage_key']} to PDF: {e}")
+        if on_placed:
+            on_placed()
+
+# Streaming uploads
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+async def inline_image_header(data_url):
     try:
-        # Generate unique filename
-        file_ext = Path(file.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = PHOTO_DIR / unique_filename
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        return await anyio.to_thread.run_sync(data_url_header, data_url)
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Image dimensions exceed the pixel limit")
+
+async def save_upload_streaming(file: UploadFile, file_path: Path, parse_header: bool = True):
+    """Stream an upload to disk in chunks, parsing the image header on the way through.
+
+    Returns (size, header, sha256 hex digest). File writes run off the event
+    loop; the header is taken from the first chunks so the file is never
+    re-read unless the format keeps its header beyond HEADER_PARSE_LIMIT.
+    Files over MAX_UPLOAD_BYTES or MAX_IMAGE_PIXELS are rejected with 413.
+    """
+    size = 0
+    header = None
+    head = b""
+    digest = hashlib.sha256()
+    started = time.perf_counter()
+    try:
+        async with await anyio.open_file(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="File is too large")
+                digest.update(chunk)
+                if parse_header and header is None and len(head) < HEADER_PARSE_LIMIT:
+                    head += chunk
+                    header = parse_image_header(head)
+                await buffer.write(chunk)
+        STAGE_SECONDS.labels(stage='upload_stream').observe(time.perf_counter() - started)
         
-        # Get image dimensions and size
-        with Image.open(file_path) as img:
-            width, height = img.size
+        if parse_header and header is None and size:
+            header = await worker_pool.run(read_image_header, str(file_path))
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        Path(file_path).unlink(missing_ok=True)
+        raise HTTPException(status_code=413, detail="Image dimensions exceed the pixel limit")
+    except Exception:
+        Path(file_path).unlink(missing_ok=True)
+        raise
+    return size, header, digest.hexdigest()
+
+# Upload normalization
+# Stored photos are upright, sRGB and at most PHOTO_MAX_DIMENSION on their
+# longest edge, so previews, edits and PDFs never pay for oversized sources.
+PHOTO_MAX_DIMENSION = int(os.environ.get('PHOTO_MAX_DIMENSION', 6000))
+NORMALIZED_MODES = ('RGB', 'RGBA', 'L')
+SRGB_PROFILE = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+
+def needs_normalization(header, max_dimension=PHOTO_MAX_DIMENSION):
+    return (
+        header['orientation'] != 1
+        or header.get('foreign_profile')
+        or header.get('mode') not in NORMALIZED_MODES
+        or max(header['width'], header['height']) > max_dimension
+    )
+
+def normalize_photo(source_path, target_path, max_dimension=PHOTO_MAX_DIMENSION):
+    """Write an upright, sRGB copy of an image, scaled down to fit max_dimension.
+
+    Lossless sources and images with transparency stay PNG; everything else
+    becomes JPEG. Returns (size, header, sha256 hex digest) of the new file.
+    """
+    with Image.open(source_path) as img:
+        source_format = img.format
+        icc_profile = img.info.get('icc_profile')
+        # Let the JPEG decoder downscale by a power of two while it still covers the cap
+        img.draft('RGB', (max_dimension, max_dimension))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+        mode = 'RGBA' if has_alpha else 'RGB'
         
-        file_size = file_path.stat().st_size
+        if icc_profile and not is_srgb_profile(icc_profile):
+            try:
+                source_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+                img = ImageCms.profileToProfile(img, source_profile, SRGB_PROFILE, outputMode=mode)
+            except (ImageCms.PyCMSError, OSError):
+                logging.warning(f"Could not apply colour profile of {source_path}")
+        if img.mode not in NORMALIZED_MODES:
+            img = img.convert(mode)
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
         
-        # Create metadata
-        photo_metadata = PhotoMetadata(
-            filename=unique_filename,
-            original_filename=file.filename,
-            file_path=str(file_path),
-            width=width,
-            height=height,
-            size=file_size
+        if has_alpha or source_format == 'PNG':
+            img.save(target_path, 'PNG')
+        else:
+            img.save(target_path, 'JPEG', quality=92, exif=img.info.get('exif', b''))
+    
+    digest = hashlib.sha256()
+    with open(target_path, 'rb') as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return Path(target_path).stat().st_size, read_image_header(target_path), digest.hexdigest()
+
+# Thumbnail renditions
+RENDITION_SIZES = (256, 512, 1024, 2048)
+RENDITION_FORMATS = {
+    # format name -> (Pillow format, file extension, media type, save options)
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': 85, 'progressive': True, 'optimize': True}),
+}
+
+def rendition_key(size, fmt):
+    return f"{fmt}_{size}"
+
+def rendition_filename(filename, size, fmt):
+    return f"{Path(filename).stem}_{size}.{RENDITION_FORMATS[fmt][1]}"
+
+def select_rendition_size(requested_size, width, height):
+    """Smallest rendition covering the requested size, or None to serve the original."""
+    longest = max(width, height)
+    candidates = [size for size in RENDITION_SIZES if size >= requested_size and size < longest]
+    return min(candidates) if candidates else None
+
+def generate_renditions(storage_key, sizes=RENDITION_SIZES, formats=tuple(RENDITION_FORMATS)):
+    """Store downscaled copies of a photo next to the original.
+
+    Returns {rendition_key: filename}. Sizes at or above the original's
+    longest edge are skipped, since the original is served for those.
+    """
+    file_path = storage.local_path(storage_key)
+    renditions = {}
+    with Image.open(file_path) as img:
+        width, height = img.size
+        if img.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    longest = max(width, height)
+    sizes = sorted((size for size in sizes if size < longest), reverse=True)
+    if not sizes:
+        return renditions
+    
+    # Decode at the scale the largest size needs, then shrink step by step
+    scale = sizes[0] / longest
+    current = load_image(file_path, (max(1, round(width * scale)), max(1, round(height * scale)))).convert('RGB')
+    
+    for size in sizes:
+        current.thumbnail((size, size), Image.LANCZOS)
+        for fmt in formats:
+            pil_format, _, _, options = RENDITION_FORMATS[fmt]
+            filename = rendition_filename(file_path.name, size, fmt)
+            staging_path = PHOTO_DIR / f".{uuid.uuid4()}.part"
+            with timed('rendition_encode'):
+                current.save(staging_path, pil_format, **options)
+            storage.put_file(object_key(PHOTO_PREFIX, filename), staging_path, RENDITION_FORMATS[fmt][2])
+            renditions[rendition_key(size, fmt)] = filename
+    return renditions
+
+def rendition_pixels(width, height, image_format, size=RENDITION_SIZES[-1]):
+    """Memory estimate for generating renditions up to `size`."""
+    return decode_pixels(width, height, (size, size), image_format)
+
+async def create_photo_renditions(photo_id, storage_key, pixels=0):
+    """Background task run after upload; missing renditions are also created on demand."""
+    try:
+        renditions = await worker_pool.run(generate_renditions, storage_key, pixels=pixels)
+        if renditions:
+            await db.photos.update_one(
+                {"id": photo_id},
+                {"$set": {f"renditions.{key}": filename for key, filename in renditions.items()}}
+            )
+            photo_cache.invalidate(photo_id)
+    except Exception as e:
+        logging.error(f"Error generating renditions for photo {photo_id}: {e}")
+
+# Content-addressed photo storage
+# Photo files are stored once per content hash; photo_blobs counts the
+# photo records that point at each file.
+BLOB_EXTENSIONS = {'JPEG': '.jpg', 'MPO': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp', 'BMP': '.bmp', 'TIFF': '.tif'}
+
+BLOB_DELETE_TIMEOUT = 60
+BLOB_DELETE_POLL_INTERVAL = 0.05
+
+def blob_filename(content_hash, image_format, fallback_ext=''):
+    return f"{content_hash}{BLOB_EXTENSIONS.get(image_format, fallback_ext.lower())}"
+
+async def store_photo_blob(temp_path: Path, content_hash, filename, size):
+    """Take a reference to the file stored under its hash and move the upload into place.
+
+    The reference is taken first, so a release running concurrently keeps the
+    blob record. If the file was already being deleted (the record carries a
+    tombstone), the upload is written once that deletion has finished; it is
+    always written, which also restores a file whose last reference was
+    dropped in the meantime. Returns True when the content was already stored.
+    """
+    previous = await db.photo_blobs.find_one_and_update(
+        {"hash": content_hash},
+        {
+            "$inc": {"ref_count": 1},
+            "$setOnInsert": {"filename": filename, "size": size, "created_at": datetime.now(timezone.utc)},
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+    try:
+        if previous is not None and previous.get('deleting'):
+            await wait_for_blob_deletion(content_hash, previous['deleting'])
+        with timed('storage_put'):
+            await anyio.to_thread.run_sync(storage.put_file, object_key(PHOTO_PREFIX, filename), temp_path)
+    except Exception:
+        temp_path.unlink(missing_ok=True)
+        await release_photo_blobs([{"filename": filename, "content_hash": content_hash}])
+        raise
+    return previous is not None
+
+async def delete_photo_files(*filenames):
+    """Remove stored photo files and every rendition derived from them."""
+    keys = []
+    for filename in filenames:
+        keys.append(object_key(PHOTO_PREFIX, filename))
+        keys.extend(
+            object_key(PHOTO_PREFIX, rendition_filename(filename, size, fmt))
+            for size in RENDITION_SIZES for fmt in RENDITION_FORMATS
         )
+    await anyio.to_thread.run_sync(functools.partial(storage.delete, *keys))
+
+async def delete_photo_blob(content_hash, condition):
+    """Delete a blob's files and record while the record matches `condition`; True if its files went.
+
+    The record is tombstoned (`deleting`) while the files are deleted, and
+    only removed afterwards if it still matches `condition`, i.e. nobody took
+    a reference in between. Uploads that find the tombstone wait for it to be
+    lifted before writing the file again.
+    """
+    token = str(uuid.uuid4())
+    blob = await db.photo_blobs.find_one_and_update(
+        {"hash": content_hash, "deleting": {"$exists": False}, **condition},
+        {"$set": {"deleting": token, "deleting_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "filename": 1},
+    )
+    if blob is None:
+        return False
+    try:
+        await delete_photo_files(blob['filename'])
+    finally:
+        result = await db.photo_blobs.delete_one({"hash": content_hash, "deleting": token, **condition})
+        if not result.deleted_count:
+            await db.photo_blobs.update_one(
+                {"hash": content_hash, "deleting": token}, {"$unset": {"deleting": "", "deleting_at": ""}}
+            )
+    return True
+
+async def wait_for_blob_deletion(content_hash, token):
+    """Wait until the deletion holding tombstone `token` has finished.
+
+    A tombstone older than BLOB_DELETE_TIMEOUT belongs to a deletion that
+    died half way; it is lifted here instead.
+    """
+    deadline = time.monotonic() + BLOB_DELETE_TIMEOUT
+    while await db.photo_blobs.count_documents({"hash": content_hash, "deleting": token}, limit=1):
+        if time.monotonic() > deadline:
+            await db.photo_blobs.update_one(
+                {"hash": content_hash, "deleting": token}, {"$unset": {"deleting": "", "deleting_at": ""}}
+            )
+            return
+        await anyio.sleep(BLOB_DELETE_POLL_INTERVAL)
+
+async def release_photo_blobs(photos):
+    """Drop one reference per photo to its file, deleting files whose last reference went."""
+    # Photos stored before content addressing own their file outright
+    unreferenced = {photo['filename'] for photo in photos if not photo.get('content_hash')}
+    
+    releases = {}
+    for photo in photos:
+        if photo.get('content_hash'):
+            releases[photo['content_hash']] = releases.get(photo['content_hash'], 0) + 1
+    if releases:
+        await db.photo_blobs.bulk_write([
+            UpdateOne({"hash": content_hash}, {"$inc": {"ref_count": -count}})
+            for content_hash, count in releases.items()
+        ], ordered=False)
+        for content_hash in releases:
+            await delete_photo_blob(content_hash, {"ref_count": {"$lte": 0}})
+    
+    if unreferenced:
+        await delete_photo_files(*unreferenced)
+
+async def release_photo_blob(photo):
+    """Drop one reference to a photo's file, deleting it with the last reference."""
+    await release_photo_blobs([photo])
+
+async def delete_photo_records(photos):
+    """Delete photo records in one query, drop them from projects and release their files."""
+    photo_ids = [photo['id'] for photo in photos]
+    await db.photos.delete_many({"id": {"$in": photo_ids}})
+    photo_cache.invalidate(*photo_ids)
+    await db.collage_projects.update_many(
+        {"photo_ids": {"$in": photo_ids}}, {"$pull": {"photo_ids": {"$in": photo_ids}}}
+    )
+    await release_photo_blobs(photos)
+
+# Photo ingestion, shared by single and batch uploads
+async def ingest_photo(file: UploadFile):
+    """Store an uploaded photo and build its metadata; the caller saves the record."""
+    # Stream to a temporary file, reading dimensions and hash on the way through
+    temp_path = PHOTO_DIR / f".{uuid.uuid4()}.part"
+    file_size, header, content_hash = await save_upload_streaming(file, temp_path)
+    if header is None:
+        temp_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Empty file" if not file_size else "Invalid image file")
+    original_width, original_height = header['width'], header['height']
+    
+    # Normalize rotated, non-sRGB or oversized images before they are stored
+    if needs_normalization(header):
+        normalized_path = PHOTO_DIR / f".{uuid.uuid4()}.part"
+        try:
+            file_size, header, content_hash = await worker_pool.run(
+                normalize_photo, str(temp_path), str(normalized_path),
+                pixels=header['width'] * header['height']
+            )
+        except (OSError, SyntaxError, ValueError):
+            normalized_path.unlink(missing_ok=True)
+            raise HTTPException(status_code=400, detail="Invalid image file")
+        except Exception:
+            normalized_path.unlink(missing_ok=True)
+            raise
+        finally:
+            temp_path.unlink(missing_ok=True)
+        temp_path = normalized_path
+    
+    # Store by content hash, sharing the file with identical uploads
+    filename = blob_filename(content_hash, header['format'], Path(file.filename).suffix)
+    duplicate = await store_photo_blob(temp_path, content_hash, filename, file_size)
+    
+    renditions = {}
+    if duplicate:
+        existing = await db.photos.find_one(
+            {"content_hash": content_hash}, {"_id": 0, "renditions": 1}
+        )
+        renditions = (existing or {}).get('renditions', {})
+    
+    # Create metadata
+    photo_metadata = PhotoMetadata(
+        filename=filename,
+        original_filename=file.filename,
+        storage_key=object_key(PHOTO_PREFIX, filename),
+        width=header['width'],
+        height=header['height'],
+        size=file_size,
+        format=header['format'],
+        orientation=header['orientation'],
+        original_width=original_width,
+        original_height=original_height,
+        content_hash=content_hash,
+        renditions=renditions
+    )
+    return photo_metadata
+
+# Upload photo endpoint
+@api_router.post("/photos/upload", response_model=PhotoMetadata)
+async def upload_photo(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    try:
+        photo_metadata = await ingest_photo(file)
         
         # Save to database
-        doc = photo_metadata.model_dump()
-        doc['uploaded_at'] = doc['uploaded_at'].isoformat()
-        await db.photos.insert_one(doc)
+        await db.photos.insert_one(photo_metadata.model_dump())
+        if not photo_metadata.renditions:
+            background_tasks.add_task(
+                create_photo_renditions, photo_metadata.id, photo_metadata.storage_key,
+                rendition_pixels(photo_metadata.width, photo_metadata.height, photo_metadata.format)
+            )
         
         return photo_metadata
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Batch upload
+UPLOAD_BATCH_LIMIT = int(os.environ.get('UPLOAD_BATCH_LIMIT', 500))
+UPLOAD_BATCH_CONCURRENCY = int(os.environ.get('UPLOAD_BATCH_CONCURRENCY', 8))
+
+def batch_semaphore():
+    # Never queue more decode work than the worker pool runs at once
+    return asyncio.Semaphore(max(1, min(UPLOAD_BATCH_CONCURRENCY, worker_pool.size)))
+
+async def create_batch_renditions(photos):
+    """Render each distinct file of a batch once and record the renditions on every photo using it."""
+    photo_ids_by_key = {}
+    pixels_by_key = {}
+    for photo in photos:
+        photo_ids_by_key.setdefault(photo.storage_key, []).append(photo.id)
+        pixels_by_key[photo.storage_key] = rendition_pixels(photo.width, photo.height, photo.format)
+    semaphore = batch_semaphore()
+    
+    async def render(storage_key, photo_ids):
+        async with semaphore:
+            try:
+                renditions = await worker_pool.run(
+                    generate_renditions, storage_key, pixels=pixels_by_key[storage_key]
+                )
+                if renditions:
+                    await db.photos.update_many(
+                        {"id": {"$in": photo_ids}},
+                        {"$set": {f"renditions.{key}": filename for key, filename in renditions.items()}}
+                    )
+                    photo_cache.invalidate(*photo_ids)
+            except Exception as e:
+                logging.error(f"Error generating renditions for {storage_key}: {e}")
+    
+    await asyncio.gather(*(render(key, ids) for key, ids in photo_ids_by_key.items()))
+
+async def insert_photo_results(results):
+    """Save the photos of successful upload results in one insert_many.
+
+    Photos the database rejected have their file reference released and
+    become per-file errors; the photos that were saved are returned.
+    """
+    accepted = [result for result in results if result.photo]
+    if not accepted:
+        return []
+    try:
+        await db.photos.insert_many([result.photo.model_dump() for result in accepted], ordered=False)
+    except BulkWriteError as e:
+        # Unordered inserts keep going past failures; only the reported entries are missing
+        for error in e.details.get('writeErrors', []):
+            result = accepted[error['index']]
+            logging.error(f"Error saving {result.filename}: {error.get('errmsg')}")
+            await release_photo_blob(result.photo.model_dump())
+            result.photo = None
+            result.error = "Could not save photo"
+    return [result.photo for result in accepted if result.photo]
+
+@api_router.post("/photos/upload/batch", response_model=List[PhotoUploadResult])
+async def upload_photos_batch(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)):
+    """Upload many photos in one request; failures are reported per file."""
+    if len(files) > UPLOAD_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {UPLOAD_BATCH_LIMIT} files per batch")
+    semaphore = batch_semaphore()
+    
+    async def ingest(file):
+        async with semaphore:
+            try:
+                return PhotoUploadResult(filename=file.filename, photo=await ingest_photo(file))
+            except HTTPException as e:
+                return PhotoUploadResult(filename=file.filename, error=str(e.detail))
+            except Exception as e:
+                logging.error(f"Error uploading {file.filename}: {e}")
+                return PhotoUploadResult(filename=file.filename, error=str(e))
+    
+    results = await asyncio.gather(*(ingest(file) for file in files))
+    try:
+        photos = await insert_photo_results(results)
     except Exception as e:
+        # Which photos were saved is unknown, so nothing is released; the orphan collector reconciles
         raise HTTPException(status_code=500, detail=str(e))
+    
+    pending = [photo for photo in photos if not photo.renditions]
+    if pending:
+        background_tasks.add_task(create_batch_renditions, pending)
+    return results
+
+# Listing pagination
+LIST_PAGE_LIMIT = 1000
+
+def encode_cursor(doc):
+    uploaded_at = doc['uploaded_at']
+    if isinstance(uploaded_at, datetime):
+        uploaded_at = uploaded_at.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([uploaded_at, doc['id']]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        uploaded_at, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(uploaded_at), str(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def list_page(collection, model, response: Response, limit, cursor=None):
+    """Keyset-paginated listing ordered by (uploaded_at, id).
+
+    Sets the X-Next-Cursor header when more documents follow.
+    """
+    query = {}
+    if cursor:
+        uploaded_at, last_id = decode_cursor(cursor)
+        query = {"$or": [
+            {"uploaded_at": {"$gt": uploaded_at}},
+            {"uploaded_at": uploaded_at, "id": {"$gt": last_id}},
+        ]}
+    projection = {"_id": 0, **{field: 1 for field in model.model_fields}}
+    docs = await collection.find(query, projection).sort(
+        [("uploaded_at", 1), ("id", 1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    return docs
 
 # Get all photos
 @api_router.get("/photos", response_model=List[PhotoMetadata])
-async def get_photos():
-    photos = await db.photos.find({}, {"_id": 0}).to_list(1000)
-    for photo in photos:
-        if isinstance(photo['uploaded_at'], str):
-            photo['uploaded_at'] = datetime.fromisoformat(photo['uploaded_at'])
-    return photos
+async def get_photos(
+    response: Response,
+    limit: int = Query(LIST_PAGE_LIMIT, ge=1, le=LIST_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+):
+    return await list_page(db.photos, PhotoMetadata, response, limit, cursor)
+
+# Cached file responses
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+FILE_RANGE_CHUNK_SIZE = 256 * 1024
+
+def parse_byte_range(range_header, file_size):
+    """Parse a single-range 'bytes=' header into inclusive (start, end).
+
+    Returns None when the header is to be ignored and the whole file served:
+    other units, multi-range requests and malformed or reversed ranges.
+    Raises 416 for ranges that lie beyond the end of the file.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0 or not file_size:
+                raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
+            return (max(0, file_size - length), file_size - 1)
+        start = int(start)
+        end = int(end) if end else None
+    except ValueError:
+        return None
+    if end is not None and end < start:
+        return None
+    if start >= file_size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
+    return (start, file_size - 1 if end is None else min(end, file_size - 1))
+
+async def iter_file_range(file_path, start, end):
+    async with await anyio.open_file(file_path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(FILE_RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def etag_matches(if_none_match, etag):
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def cached_file_response(request: Request, file_path: Path, etag=None, media_type=None,
+                         filename=None, cache_control=REVALIDATE_CACHE_CONTROL):
+    """Serve a file with a strong ETag, If-None-Match revalidation and byte ranges.
+
+    The ETag defaults to the file's mtime and size; pass the content hash
+    for content-addressed files.
+    """
+    try:
+        stat_result = file_path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    etag = f'"{etag or f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_byte_range(range_header, stat_result.st_size)
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        if filename:
+            headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        media_type = media_type or mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+        return StreamingResponse(
+            iter_file_range(file_path, start, end), status_code=206, media_type=media_type, headers=headers
+        )
+    
+    return FileResponse(file_path, media_type=media_type, filename=filename, headers=headers, stat_result=stat_result)
+
+def storage_response(request: Request, key, etag=None, media_type=None, filename=None,
+                     cache_control=REVALIDATE_CACHE_CONTROL):
+    """Serve a stored object: a redirect to a presigned URL when the backend has one, else the file itself."""
+    url = storage.download_url(key, media_type=media_type, filename=filename, cache_control=cache_control)
+    if url:
+        return RedirectResponse(url, status_code=307)
+    return cached_file_response(request, storage.local_path(key), etag, media_type, filename, cache_control)
 
 # Get photo file
 @api_router.get("/photos/{photo_id}/file")
-async def get_photo_file(photo_id: str):
-    photo = await db.photos.find_one({"id": photo_id}, {"_id": 0})
+async def get_photo_file(
+    request: Request,
+    photo_id: str,
+    size: Optional[int] = Query(None, gt=0),
+    fmt: Optional[str] = Query(None, alias="format"),
+):
+    photo = await photo_cache.get(photo_id)
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     
-    file_path = Path(photo['file_path'])
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
+    if fmt is not None and fmt not in RENDITION_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    if fmt is not None and size is None:
+        raise HTTPException(status_code=400, detail="format requires a size")
+    
+    # Content-addressed files never change, so browsers may keep them forever
+    content_hash = photo.get('content_hash')
+    cache_control = IMMUTABLE_CACHE_CONTROL if content_hash else REVALIDATE_CACHE_CONTROL
+    
+    rendition_size = select_rendition_size(size, photo['width'], photo['height']) if size else None
+    if rendition_size is None:
+        return storage_response(request, photo['storage_key'], etag=content_hash, cache_control=cache_control)
     
-    return FileResponse(file_path)
+    # Serve the downscaled copy, generating it on demand for older photos
+    fmt = fmt or 'jpeg'
+    key = rendition_key(rendition_size, fmt)
+    filename = photo.get('renditions', {}).get(key) or rendition_filename(photo['filename'], rendition_size, fmt)
+    rendition_object = object_key(PHOTO_PREFIX, filename)
+    if key not in photo.get('renditions', {}) and not await anyio.to_thread.run_sync(storage.exists, rendition_object):
+        try:
+            await worker_pool.run(
+                generate_renditions, photo['storage_key'], sizes=(rendition_size,), formats=(fmt,),
+                pixels=rendition_pixels(photo['width'], photo['height'], photo.get('format'), rendition_size)
+            )
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
+        await db.photos.update_one({"id": photo_id}, {"$set": {f"renditions.{key}": filename}})
+        photo_cache.invalidate(photo_id)
+    
+    return storage_response(
+        request, rendition_object,
+        etag=f"{content_hash}-{key}" if content_hash else None,
+        media_type=RENDITION_FORMATS[fmt][2],
+        cache_control=cache_control,
+    )
 
 # Delete photo
 @api_router.delete("/photos/{photo_id}")
@@ -152,50 +1545,191 @@ async def delete_photo(photo_id: str):
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     
-    # Delete file
-    file_path = Path(photo['file_path'])
-    if file_path.exists():
-        file_path.unlink()
-    
-    # Delete from database
-    await db.photos.delete_one({"id": photo_id})
+    # Delete from database, then the file once no other photo shares it
+    await delete_photo_records([photo])
     
     return {"message": "Photo deleted successfully"}
 
+# Delete many photos
+PHOTO_DELETE_LIMIT = int(os.environ.get('PHOTO_DELETE_LIMIT', 1000))
+
+@api_router.post("/photos/delete", response_model=PhotoDeleteResult)
+async def delete_photos(request: PhotoDeleteRequest):
+    if len(request.photo_ids) > PHOTO_DELETE_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {PHOTO_DELETE_LIMIT} photos can be deleted at once")
+    
+    photo_ids = list(dict.fromkeys(request.photo_ids))
+    photos = await db.photos.find(
+        {"id": {"$in": photo_ids}}, {"_id": 0, "id": 1, "filename": 1, "content_hash": 1}
+    ).to_list(None)
+    if photos:
+        await delete_photo_records(photos)
+    
+    deleted = {photo['id'] for photo in photos}
+    return PhotoDeleteResult(
+        deleted=[photo_id for photo_id in photo_ids if photo_id in deleted],
+        not_found=[photo_id for photo_id in photo_ids if photo_id not in deleted],
+    )
+
 # Image processing endpoint
-@api_router.post("/photos/process")
-async def process_image(request: ImageProcessRequest):
-    try:
+IMAGE_OPERATIONS = ('rotate', 'brightness', 'contrast', 'blur', 'sharpen', 'grayscale')
+
+def apply_image_operation(img, operation, value=None):
+    if operation == 'rotate':
+        img = img.rotate(value or 90, expand=True)
+    elif operation == 'brightness':
+        enhancer = ImageEnhance.Brightness(img)
+        img = enhancer.enhance(value or 1.0)
+    elif operation == 'contrast':
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(value or 1.0)
+    elif operation == 'blur':
+        img = img.filter(ImageFilter.BLUR)
+    elif operation == 'sharpen':
+        img = img.filter(ImageFilter.SHARPEN)
+    elif operation == 'grayscale':
+        img = ImageOps.grayscale(img)
+    return img
+
+def source_target_size(operations, target_size):
+    """The decode size that yields `target_size` or above once `operations` are applied.
+
+    Quarter turns swap the width and height; any other rotation asks for a
+    square covering both.
+    """
+    if not target_size:
+        return target_size
+    width, height = target_size
+    quarter_turns = 0
+    for op in operations:
+        if op['operation'] == 'rotate':
+            angle = op.get('value') or 90
+            if angle % 90:
+                side = max(width, height)
+                return side, side
+            quarter_turns += int(angle // 90)
+    return (height, width) if quarter_turns % 2 else (width, height)
+
+def load_edited_image(file_path, operations, target_size=None):
+    """Decode a photo upright and apply an operation list to it, ending at `target_size` or above."""
+    img = load_image(file_path, source_target_size(operations, target_size))
+    with timed('image_operation'):
+        for op in operations:
+            img = apply_image_operation(img, op['operation'], op.get('value'))
+    return img
+
+def process_image_data(image_data, operation, value=None):
+    """Apply one operation to a base64 data URL and return a PNG data URL."""
+    key = RenderCache.make_key('process', hashlib.sha256(image_data.encode()).hexdigest(), operation, value)
+    png = render_cache.get(key)
+    if png is None:
         # Decode base64 image
-        image_data = base64.b64decode(request.image_data.split(',')[1])
-        img = Image.open(io.BytesIO(image_data))
+        with timed('base64_decode'):
+            image_bytes = base64.b64decode(image_data.split(',')[1])
+        img = load_image(image_bytes)
         
         # Apply operation
-        if request.operation == 'rotate':
-            img = img.rotate(request.value or 90, expand=True)
-        elif request.operation == 'brightness':
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(request.value or 1.0)
-        elif request.operation == 'contrast':
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(request.value or 1.0)
-        elif request.operation == 'blur':
-            img = img.filter(ImageFilter.BLUR)
-        elif request.operation == 'sharpen':
-            img = img.filter(ImageFilter.SHARPEN)
-        elif request.operation == 'grayscale':
-            img = ImageOps.grayscale(img)
+        with timed('image_operation'):
+            img = apply_image_operation(img, operation, value)
         
-        # Convert back to base64
+        # Convert back to PNG
         buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        processed_data = base64.b64encode(buffer.getvalue()).decode()
-        
-        return {"processed_image": f"data:image/png;base64,{processed_data}"}
+        with timed('image_encode'):
+            img.save(buffer, format='PNG')
+        png = buffer.getvalue()
+        render_cache.put(key, png)
+    
+    with timed('base64_encode'):
+        processed_data = base64.b64encode(png).decode()
+    return f"data:image/png;base64,{processed_data}"
+
+@api_router.post("/photos/process")
+async def process_image(request: ImageProcessRequest):
+    try:
+        header = await inline_image_header(request.image_data)
+        if header is None:
+            raise HTTPException(status_code=400, detail="Invalid image data")
+        processed_image = await worker_pool.run(
+            process_image_data, request.image_data, request.operation, request.value,
+            pixels=header['width'] * header['height']
+        )
+        return {"processed_image": processed_image}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Non-destructive photo edits
+def edit_render_key(source_key, operations):
+    """Render cache key for a photo rendered with a given recipe."""
+    return RenderCache.make_key('edit', source_key, operations)
+
+def render_photo_edits(storage_key, operations, render_key):
+    """Apply an operation list in a single decode/encode pass, via the render cache."""
+    data = render_cache.get(render_key)
+    if data is None:
+        data = encode_image(load_edited_image(storage.local_path(storage_key), operations))
+        render_cache.put(render_key, data)
+    return data
+
+@api_router.put("/photos/{photo_id}/edits")
+async def update_photo_edits(photo_id: str, request: PhotoEditRequest):
+    photo = await db.photos.find_one({"id": photo_id}, {"_id": 0})
+    if not photo:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    
+    unknown = [op.operation for op in request.operations if op.operation not in IMAGE_OPERATIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown operation: {', '.join(unknown)}")
+    
+    operations = [op.model_dump() for op in request.operations]
+    edit_key = None
+    if operations:
+        edit_key = edit_render_key(photo.get('content_hash') or photo['id'], operations)
+        try:
+            await worker_pool.run(
+                render_photo_edits, photo['storage_key'], operations, edit_key,
+                pixels=photo['width'] * photo['height']
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    await db.photos.update_one(
+        {"id": photo_id},
+        {"$set": {"edits": operations, "edit_key": edit_key}}
+    )
+    photo_cache.invalidate(photo_id)
+    
+    url = f"/api/photos/{photo_id}/edited" if edit_key else f"/api/photos/{photo_id}/file"
+    return {"edits": operations, "url": url}
+
+# Get edited photo
+@api_router.get("/photos/{photo_id}/edited")
+async def get_edited_photo(request: Request, photo_id: str):
+    photo = await db.photos.find_one({"id": photo_id}, {"_id": 0})
+    if not photo:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    if not photo.get('edit_key'):
+        raise HTTPException(status_code=404, detail="Photo has no edits")
+    
+    # The key is derived from content and recipe, so it doubles as the ETag
+    etag = f'"{photo["edit_key"]}"'
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    # Re-rendered from the stored recipe if the cache has evicted it
+    data = render_cache.get(photo['edit_key'], memory_only=True)
+    if data is None:
+        data = await worker_pool.run(
+            render_photo_edits, photo['storage_key'], photo['edits'], photo['edit_key'],
+            pixels=photo['width'] * photo['height']
+        )
+    return Response(content=data, media_type=image_media_type(data), headers=headers)
+
 # Upload letterhead
 @api_router.post("/letterheads/upload", response_model=LetterheadMetadata)
 async def upload_letterhead(name: str, file: UploadFile = File(...)):
@@ -204,118 +1738,947 @@ async def upload_letterhead(name: str, file: UploadFile = File(...)):
         file_ext = Path(file.filename).suffix
         unique_filename = f"{uuid.uuid4()}{file_ext}"
         file_path = LETTERHEAD_DIR / unique_filename
+        storage_key = object_key(LETTERHEAD_PREFIX, unique_filename)
         
         # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await save_upload_streaming(file, file_path, parse_header=False)
+        await anyio.to_thread.run_sync(storage.put_file, storage_key, file_path)
         
         # Create metadata
         letterhead_metadata = LetterheadMetadata(
             name=name,
             filename=unique_filename,
-            file_path=str(file_path)
+            storage_key=storage_key
         )
         
         # Save to database
-        doc = letterhead_metadata.model_dump()
-        doc['uploaded_at'] = doc['uploaded_at'].isoformat()
-        await db.letterheads.insert_one(doc)
+        await db.letterheads.insert_one(letterhead_metadata.model_dump())
         
         return letterhead_metadata
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Get all letterheads
 @api_router.get("/letterheads", response_model=List[LetterheadMetadata])
-async def get_letterheads():
-    letterheads = await db.letterheads.find({}, {"_id": 0}).to_list(1000)
-    for letterhead in letterheads:
-        if isinstance(letterhead['uploaded_at'], str):
-            letterhead['uploaded_at'] = datetime.fromisoformat(letterhead['uploaded_at'])
-    return letterheads
+async def get_letterheads(
+    response: Response,
+    limit: int = Query(LIST_PAGE_LIMIT, ge=1, le=LIST_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+):
+    return await list_page(db.letterheads, LetterheadMetadata, response, limit, cursor)
 
 # Get letterhead file
 @api_router.get("/letterheads/{letterhead_id}/file")
-async def get_letterhead_file(letterhead_id: str):
-    letterhead = await db.letterheads.find_one({"id": letterhead_id}, {"_id": 0})
+async def get_letterhead_file(request: Request, letterhead_id: str):
+    letterhead = await letterhead_cache.get(letterhead_id)
     if not letterhead:
         raise HTTPException(status_code=404, detail="Letterhead not found")
     
-    file_path = Path(letterhead['file_path'])
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    return FileResponse(file_path)
+    return storage_response(request, letterhead['storage_key'])
 
 # Generate PDF
+def render_collage_pdf(output, page_size, letterhead_key=None, layout=None, photos=(),
+                       images=(), fit_mode='cover', dpi=300, progress=None, bleed=0,
+                       letterhead_height=LETTERHEAD_HEIGHT):
+    """Draw a collage with ReportLab and save it to `output`.
+
+    Layout photos are paginated across as many pages as needed, with the
+    letterhead repeated on each; inline `images` go on the first page.
+    `page_size` is the trimmed page; with a `bleed` the media box grows by
+    that much on every side and TrimBox/BleedBox are set for the printer.
+    Runs inside the worker pool, so it only takes plain, picklable values.
+    Every image is resampled to `dpi` for the rectangle it is placed in.
+    `progress(done, total)` is called as each image is placed. `output` is a
+    path or a binary file object. Returns the size of the PDF in bytes.
+    """
+    width, height = page_size
+    media_box = (width + 2 * bleed, height + 2 * bleed)
+    boxes = {}
+    if bleed:
+        boxes = {"trimBox": (bleed, bleed, bleed + width, bleed + height), "bleedBox": (0, 0) + media_box}
+    c = canvas.Canvas(output if hasattr(output, 'write') else str(output), pagesize=media_box, **boxes)
+    image_set = PDFImageSet()
+    total = len(photos) + len(images)
+    done = 0
+    
+    def advance():
+        nonlocal done
+        done += 1
+        if progress:
+            progress(done, total)
+    
+    letterhead = None
+    if letterhead_key:
+        try:
+            letterhead = prepare_letterhead(letterhead_key, width, letterhead_height, dpi)
+        except FileNotFoundError:
+            logging.error(f"Letterhead {letterhead_key} is missing from storage")
+    
+    # Stored photos fill as many layout pages as needed
+    pages = [()]
+    if layout:
+        per_page = len(COLLAGE_LAYOUTS[layout]['cells'])
+        pages = [photos[i:i + per_page] for i in range(0, len(photos), per_page)] or [()]
+    
+    with timed('pdf_draw'):
+        for page_number, page_photos in enumerate(pages):
+            if page_number:
+                c.showPage()
+            # Draw in trimmed-page coordinates
+            c.translate(bleed, bleed)
+            top_offset = 0
+            
+            # Add letterhead if provided, repeated on every page
+            if letterhead:
+                key, data = letterhead
+                img = image_set.reader(key, lambda: data, keep=True)
+                c.drawImage(img, 0, height - letterhead_height, width, letterhead_height, preserveAspectRatio=True, mask='auto')
+                top_offset = letterhead_height
+            
+            # Render stored photos into the layout slots
+            if layout:
+                draw_collage_layout(
+                    c, layout, page_photos, width, height,
+                    top_offset=top_offset, fit_mode=fit_mode, dpi=dpi, on_placed=advance,
+                    image_set=image_set
+                )
+            
+            # Add images to PDF
+            for img_data in (images if page_number == 0 else ()):
+                try:
+                    # Draw image on PDF
+                    x = img_data.get('x', 0)
+                    y = height - img_data.get('y', 0) - img_data.get('height', 100)
+                    w = img_data.get('width', 100)
+                    h = img_data.get('height', 100)
+                    
+                    # Decode base64 image, downsampled for its placed size
+                    with timed('base64_decode'):
+                        image_bytes = base64.b64decode(img_data['data'].split(',')[1])
+                    
+                    key = RenderCache.make_key('inline', hashlib.sha256(image_bytes).hexdigest(), w, h, dpi)
+                    img = image_set.reader(key, functools.partial(prepare_placed_image, image_bytes, w, h, dpi))
+                    
+                    c.drawImage(img, x, y, w, h, preserveAspectRatio=True, mask='auto')
+                except Exception as e:
+                    logging.error(f"Error adding image to PDF: {e}")
+                advance()
+            
+            image_set.end_page()
+    
+    with timed('pdf_save'):
+        c.save()
+    if hasattr(output, 'write'):
+        return output.tell()
+    return Path(output).stat().st_size
+
+# Embedded streams make a book's memory grow with its length: the reservation
+# from estimate_pdf_pixels rejects books that would not fit the request
+# budget (413), and the photo count is capped on top of that.
+PDF_BOOK_MAX_PHOTOS = int(os.environ.get('PDF_BOOK_MAX_PHOTOS', 500))
+LAYOUT_PHOTO_FIELDS = ('storage_key', 'content_hash', 'edits', 'width', 'height', 'format')
+
+# ReportLab holds every embedded image stream until the document is saved;
+# each placed image is allowed this many encoded bytes per placed pixel
+# (photos at PDF_JPEG_QUALITY typically need 0.1-0.2).
+PDF_STREAM_BYTES_PER_PIXEL = float(os.environ.get('PDF_STREAM_BYTES_PER_PIXEL', 0.3))
+
+def estimate_pdf_pixels(page_size, layout=None, photos=(), images=(), dpi=300,
+                        letterhead_height=LETTERHEAD_HEIGHT, **_):
+    """Peak memory of a render_collage_pdf call, in decoded pixels.
+
+    Images are decoded one at a time, so decoding needs the largest single
+    decode plus its fitted copy. The encoded streams of all placed images are
+    added on top, at PDF_STREAM_BYTES_PER_PIXEL. The letterhead's source
+    size is unknown and is allowed four times its band, as are inline images
+    without a readable `header` (see prepare_pdf_render).
+    """
+    width, height = page_size
+    band_width, band_height = pixel_size(width, letterhead_height, dpi)
+    peak = 4 * band_width * band_height
+    placed = band_width * band_height
+    if layout:
+        slots = compute_layout_slots(layout, width, height, letterhead_height)
+        for index, photo in enumerate(photos):
+            _, _, w, h = slots[index % len(slots)]
+            target_width, target_height = pixel_size(w, h, dpi)
+            decoded = decode_pixels(
+                photo.get('width') or PHOTO_MAX_DIMENSION, photo.get('height') or PHOTO_MAX_DIMENSION,
+                source_target_size(photo.get('edits') or [], (target_width, target_height)), photo.get('format')
+            )
+            peak = max(peak, decoded + target_width * target_height)
+            placed += target_width * target_height
+    for image in images:
+        target_width, target_height = pixel_size(image.get('width', 100), image.get('height', 100), dpi)
+        header = image.get('header')
+        if header:
+            decoded = decode_pixels(header['width'], header['height'], (target_width, target_height), header['format'])
+            peak = max(peak, decoded + target_width * target_height)
+        else:
+            peak = max(peak, 4 * target_width * target_height)
+        placed += target_width * target_height
+    return peak + int(placed * PDF_STREAM_BYTES_PER_PIXEL / BYTES_PER_PIXEL)
+
+async def prepare_pdf_render(request: PDFGenerateRequest):
+    """Validate an export request and resolve it into render_collage_pdf arguments."""
+    if request.layout and request.layout not in COLLAGE_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unknown layout: {request.layout}")
+    if request.fit_mode not in ('cover', 'contain'):
+        raise HTTPException(status_code=400, detail=f"Unknown fit mode: {request.fit_mode}")
+    if request.quality not in PDF_QUALITY_DPI:
+        raise HTTPException(status_code=400, detail=f"Unknown quality: {request.quality}")
+    if request.page_size not in PAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown page size: {request.page_size}")
+    if request.orientation not in ('portrait', 'landscape'):
+        raise HTTPException(status_code=400, detail=f"Unknown orientation: {request.orientation}")
+    
+    letterhead_id = request.letterhead_id
+    photo_ids = request.photo_ids
+    if request.book:
+        if not request.layout:
+            raise HTTPException(status_code=400, detail="Book export requires a layout")
+        if not photo_ids or not letterhead_id:
+            project = await db.collage_projects.find_one(
+                {"id": request.project_id}, {"_id": 0, "photo_ids": 1, "letterhead_id": 1}
+            )
+            # Explicit photos need no project; a missing one then just means no letterhead
+            if not project and not photo_ids:
+                raise HTTPException(status_code=404, detail="Project not found")
+            project = project or {}
+            photo_ids = photo_ids or project.get('photo_ids') or []
+            letterhead_id = letterhead_id or project.get('letterhead_id')
+        if len(photo_ids) > PDF_BOOK_MAX_PHOTOS:
+            raise HTTPException(
+                status_code=400, detail=f"Book export is limited to {PDF_BOOK_MAX_PHOTOS} photos"
+            )
+    
+    letterhead_key = None
+    if letterhead_id:
+        letterhead = await letterhead_cache.get(letterhead_id)
+        if letterhead:
+            letterhead_key = letterhead['storage_key']
+    
+    layout_photos = []
+    if request.layout:
+        if not request.book:
+            photo_ids = photo_ids[:len(COLLAGE_LAYOUTS[request.layout]['cells'])]
+        photos = await db.photos.find(
+            {"id": {"$in": photo_ids}},
+            {"_id": 0, "id": 1, **{key: 1 for key in LAYOUT_PHOTO_FIELDS}}
+        ).to_list(None)
+        photos_by_id = {photo['id']: photo for photo in photos}
+        missing = [photo_id for photo_id in photo_ids if photo_id not in photos_by_id]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Photo not found: {', '.join(missing)}")
+        layout_photos = [
+            {key: photos_by_id[photo_id].get(key) for key in LAYOUT_PHOTO_FIELDS}
+            for photo_id in photo_ids
+        ]
+    
+    # Inline images carry their source header so their decode can be budgeted
+    images = []
+    for image in request.images:
+        header = await inline_image_header(image['data']) if isinstance(image.get('data'), str) else None
+        images.append({**image, "header": header})
+    
+    return {
+        **page_geometry(request.page_size, request.orientation, request.bleed_mm),
+        "letterhead_key": letterhead_key,
+        "layout": request.layout,
+        "photos": layout_photos,
+        "images": images,
+        "fit_mode": request.fit_mode,
+        "dpi": request.dpi or PDF_QUALITY_DPI[request.quality],
+    }
+
+async def store_project_pdf(project_id, pdf_filename):
+    """Move a rendered PDF from PDF_DIR into storage and link it to its project."""
+    pdf_key = object_key(PDF_PREFIX, pdf_filename)
+    await anyio.to_thread.run_sync(storage.put_file, pdf_key, PDF_DIR / pdf_filename, 'application/pdf')
+    await db.collage_projects.update_one(
+        {"id": project_id},
+        {"$set": {"pdf_key": pdf_key}}
+    )
+
 @api_router.post("/pdf/generate")
 async def generate_pdf(request: PDFGenerateRequest):
     try:
+        render_args = await prepare_pdf_render(request)
+        
+        if request.stream:
+            # Rendered to a temporary file outside storage and sent from disk, so the
+            # PDF is never held in memory; the file is deleted once it is closed,
+            # which also happens when an abandoned response is collected
+            pdf_file = tempfile.NamedTemporaryFile(prefix='collage-', suffix='.pdf')
+            try:
+                await worker_pool.run(
+                    render_collage_pdf, pdf_file.name, pixels=estimate_pdf_pixels(**render_args), **render_args
+                )
+            except BaseException:
+                pdf_file.close()
+                raise
+            return FileResponse(
+                pdf_file.name,
+                media_type='application/pdf',
+                filename=f"collage-{request.project_id}.pdf",
+                headers={"Cache-Control": "no-store"},
+                background=BackgroundTask(pdf_file.close),
+            )
+        
         # Generate unique filename for PDF
         pdf_filename = f"{uuid.uuid4()}.pdf"
         pdf_path = PDF_DIR / pdf_filename
         
         # Create PDF
-        c = canvas.Canvas(str(pdf_path), pagesize=A4)
-        width, height = A4
-        
-        # Add letterhead if provided
-        if request.letterhead_id:
-            letterhead = await db.letterheads.find_one({"id": request.letterhead_id}, {"_id": 0})
-            if letterhead:
-                letterhead_path = Path(letterhead['file_path'])
-                if letterhead_path.exists():
-                    img = ImageReader(str(letterhead_path))
-                    c.drawImage(img, 0, height - 100, width, 100, preserveAspectRatio=True, mask='auto')
-        
-        # Add images to PDF
-        for img_data in request.images:
-            try:
-                # Decode base64 image
-                image_bytes = base64.b64decode(img_data['data'].split(',')[1])
-                img = ImageReader(io.BytesIO(image_bytes))
-                
-                # Draw image on PDF
-                x = img_data.get('x', 0)
-                y = height - img_data.get('y', 0) - img_data.get('height', 100)
-                w = img_data.get('width', 100)
-                h = img_data.get('height', 100)
-                
-                c.drawImage(img, x, y, w, h, preserveAspectRatio=True, mask='auto')
-            except Exception as e:
-                logging.error(f"Error adding image to PDF: {e}")
-                continue
-        
-        c.save()
-        
-        # Update project with PDF path
-        await db.collage_projects.update_one(
-            {"id": request.project_id},
-            {"$set": {"pdf_path": str(pdf_path)}}
+        pdf_size = await worker_pool.run(
+            render_collage_pdf, str(pdf_path), pixels=estimate_pdf_pixels(**render_args), **render_args
         )
+        await store_project_pdf(request.project_id, pdf_filename)
         
-        return {"pdf_url": f"/api/pdf/{pdf_filename}"}
+        return {"pdf_url": f"/api/pdf/{pdf_filename}", "size": pdf_size}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# PDF export jobs
+# Live state of jobs started by this process; finished jobs are read from Mongo.
+# Jobs queue for a worker slot rather than being turned away, and stay
+# 'queued' until they have one.
+PDF_JOB_TIMEOUT = float(os.environ.get('PDF_JOB_TIMEOUT', 600))
+pdf_jobs: Dict[str, dict] = {}
+_pdf_job_tasks = set()
+
+def record_pdf_job_progress(job_id, done, total):
+    # Called from worker threads; a single dict assignment is atomic
+    job = pdf_jobs.get(job_id)
+    if job is not None:
+        job['progress'] = {"done": done, "total": total}
+
+async def update_pdf_job(job_id, **fields):
+    if job_id in pdf_jobs:
+        pdf_jobs[job_id].update(fields)
+    await db.pdf_jobs.update_one({"id": job_id}, {"$set": fields})
+
+async def run_pdf_job(job_id, project_id, render_args):
+    pdf_filename = f"{uuid.uuid4()}.pdf"
+    pdf_path = PDF_DIR / pdf_filename
+    # Progress callbacks cannot reach back from a process pool
+    progress = functools.partial(record_pdf_job_progress, job_id) if worker_pool.kind == 'thread' else None
+    try:
+        pdf_size = await worker_pool.run(
+            render_collage_pdf, str(pdf_path), progress=progress, timeout=PDF_JOB_TIMEOUT,
+            pixels=estimate_pdf_pixels(**render_args), wait=True,
+            on_admitted=functools.partial(update_pdf_job, job_id, status='running'), **render_args
+        )
+        await store_project_pdf(project_id, pdf_filename)
+        total = len(render_args['photos']) + len(render_args['images'])
+        await update_pdf_job(
+            job_id, status='done', pdf_url=f"/api/pdf/{pdf_filename}", size=pdf_size,
+            progress={"done": total, "total": total}, finished_at=datetime.now(timezone.utc)
+        )
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        logging.error(f"PDF job {job_id} failed: {error}")
+        await update_pdf_job(job_id, status='failed', error=error, finished_at=datetime.now(timezone.utc))
+    finally:
+        pdf_jobs.pop(job_id, None)
+
+@api_router.post("/pdf/jobs", response_model=PDFJob, status_code=202)
+async def create_pdf_job(request: PDFGenerateRequest):
+    render_args = await prepare_pdf_render(request)
+    if estimate_pdf_pixels(**render_args) * BYTES_PER_PIXEL > memory_budget.request_limit:
+        raise HTTPException(status_code=413, detail="Request exceeds the image memory budget")
+    
+    job = PDFJob(
+        project_id=request.project_id,
+        progress={"done": 0, "total": len(render_args['photos']) + len(render_args['images'])}
+    )
+    await db.pdf_jobs.insert_one(job.model_dump())
+    pdf_jobs[job.id] = job.model_dump()
+    
+    task = asyncio.create_task(run_pdf_job(job.id, request.project_id, render_args))
+    _pdf_job_tasks.add(task)
+    task.add_done_callback(_pdf_job_tasks.discard)
+    return job
+
+async def fail_interrupted_pdf_jobs():
+    """Mark jobs left queued or running by a previous process as failed; they run in the process that took them."""
+    result = await db.pdf_jobs.update_many(
+        {"status": {"$in": ["queued", "running"]}},
+        {"$set": {
+            "status": "failed", "error": "Interrupted by a server restart",
+            "finished_at": datetime.now(timezone.utc),
+        }}
+    )
+    if result.modified_count:
+        logging.warning(f"Marked {result.modified_count} interrupted PDF jobs as failed")
+
+@api_router.get("/pdf/jobs/{job_id}", response_model=PDFJob)
+async def get_pdf_job(job_id: str):
+    job = pdf_jobs.get(job_id) or await db.pdf_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="PDF job not found")
+    return job
+
 # Download PDF
 @api_router.get("/pdf/{pdf_filename}")
-async def download_pdf(pdf_filename: str):
-    pdf_path = PDF_DIR / pdf_filename
-    if not pdf_path.exists():
+async def download_pdf(request: Request, pdf_filename: str):
+    if Path(pdf_filename).name != pdf_filename or Path(pdf_filename).suffix != '.pdf':
         raise HTTPException(status_code=404, detail="PDF not found")
     
-    return FileResponse(pdf_path, filename=pdf_filename, media_type='application/pdf')
+    # Exported PDFs get a fresh name every time, so their bytes never change
+    return storage_response(
+        request, object_key(PDF_PREFIX, pdf_filename), media_type='application/pdf',
+        filename=pdf_filename, cache_control=IMMUTABLE_CACHE_CONTROL
+    )
+
+# PDF retention
+PDF_RETENTION_SECONDS = float(os.environ.get('PDF_RETENTION_HOURS', 7 * 24)) * 3600
+PDF_DIR_MAX_BYTES = int(float(os.environ.get('PDF_DIR_MAX_MB', 1024)) * 1024 * 1024)
+PDF_SWEEP_INTERVAL = float(os.environ.get('PDF_SWEEP_INTERVAL', 600))
+PDF_MIN_AGE = 300  # fresh exports are never swept, so their download link keeps working
+
+def sweep_pdf_dir(now=None):
+    """Delete expired exports, then the oldest ones until stored PDFs fit their size cap.
+
+    Returns the object keys that were removed.
+    """
+    now = now or time.time()
+    objects = sorted(
+        (mtime, size, key) for key, size, mtime in storage.list(PDF_PREFIX) if key.endswith('.pdf')
+    )
+    
+    total = sum(size for _, size, _ in objects)
+    removed = []
+    for mtime, size, key in objects:
+        age = now - mtime
+        if age < PDF_MIN_AGE or (age < PDF_RETENTION_SECONDS and total <= PDF_DIR_MAX_BYTES):
+            break
+        total -= size
+        removed.append(key)
+    storage.delete(*removed)
+    return removed
+
+async def sweep_pdfs_periodically():
+    while True:
+        try:
+            removed = await anyio.to_thread.run_sync(sweep_pdf_dir)
+            if removed:
+                await db.collage_projects.update_many(
+                    {"pdf_key": {"$in": removed}}, {"$unset": {"pdf_key": ""}}
+                )
+                logging.info(f"Swept {len(removed)} exported PDFs")
+            freed = await anyio.to_thread.run_sync(storage.trim_cache)
+            if freed:
+                logging.info(f"Trimmed {freed} bytes from the storage cache")
+        except Exception as e:
+            logging.error(f"PDF sweep failed: {e}")
+        await asyncio.sleep(PDF_SWEEP_INTERVAL)
+
+# Orphan collection
+# Reconciles storage with the photos, letterheads and collage_projects
+# collections: stored files nothing refers to, records whose file is gone
+# and project references to deleted documents. Everything is scanned in
+# batches, paced to GC_RATE storage/database operations per second.
+GC_INTERVAL = float(os.environ.get('GC_INTERVAL', 24 * 3600))  # 0 disables the periodic run
+GC_RATE = float(os.environ.get('GC_RATE', 50))
+GC_BATCH_SIZE = int(os.environ.get('GC_BATCH_SIZE', 200))
+GC_MIN_AGE = float(os.environ.get('GC_MIN_AGE', 3600))  # younger files and records may be mid-upload
+GC_DRY_RUN = os.environ.get('GC_DRY_RUN', '').lower() in ('1', 'true', 'yes')
+# Records whose file is missing are only reported unless this is set
+GC_DELETE_RECORDS = os.environ.get('GC_DELETE_RECORDS', '').lower() in ('1', 'true', 'yes')
+GC_MAX_ORPHAN_FRACTION = float(os.environ.get('GC_MAX_ORPHAN_FRACTION', 0.1))
+
+class RateLimiter:
+    """Paces callers to at most `rate` operations per second; 0 means unlimited."""
+    
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+    
+    async def wait(self, operations=1):
+        now = time.monotonic()
+        start = max(now, self._next)
+        self._next = start + operations * self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+def photo_file_stem(key):
+    """The stored photo a key belongs to: its own stem, or its original's for a rendition."""
+    stem = Path(key).stem
+    base, _, size = stem.rpartition('_')
+    if base and size.isdigit() and int(size) in RENDITION_SIZES:
+        return base
+    return stem
+
+class OrphanCollector:
+    """One reconciliation pass; `report` counts what was found (and removed unless `dry_run`).
+
+    Each category is scanned completely before anything in it is removed. A
+    category where more than `max_orphan_fraction` of what was scanned looks
+    orphaned is left alone and listed under `aborted`, since that points at
+    misconfigured storage or database settings rather than real orphans.
+    Records whose file is missing are only reported unless `delete_records`.
+    """
+    
+    def __init__(self, rate=GC_RATE, batch_size=GC_BATCH_SIZE, min_age=GC_MIN_AGE, dry_run=False,
+                 delete_records=GC_DELETE_RECORDS, max_orphan_fraction=GC_MAX_ORPHAN_FRACTION):
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.min_age = min_age
+        self.dry_run = dry_run
+        self.delete_records = delete_records
+        self.max_orphan_fraction = max_orphan_fraction
+        self.report = {
+            "dry_run": dry_run,
+            "delete_records": delete_records,
+            "started_at": datetime.now(timezone.utc),
+            "finished_at": None,
+            "photo_files": 0,
+            "photo_file_bytes": 0,
+            "photo_blobs": 0,
+            "photo_records": 0,
+            "letterhead_files": 0,
+            "letterhead_file_bytes": 0,
+            "letterhead_records": 0,
+            "project_references": 0,
+            "aborted": {},
+        }
+    
+    async def run(self):
+        # Blobs go first, so the files they released are collected in the same pass
+        await self.collect_photo_blobs()
+        await self.collect_photo_files()
+        await self.collect_photo_records()
+        await self.collect_letterhead_files()
+        await self.collect_letterhead_records()
+        await self.collect_project_references()
+        self.report["finished_at"] = datetime.now(timezone.utc)
+        return self.report
+    
+    def _found(self, category, label, items, remove=True):
+        self.report[category] += len(items)
+        action = "Removing" if remove and not self.dry_run else "Found"
+        for item in items:
+            logging.info(f"{action} orphaned {label}: {item}")
+    
+    def _within_limit(self, category, found, scanned):
+        """Whether `found` orphans out of `scanned` are few enough to act on."""
+        if found <= self.max_orphan_fraction * scanned:
+            return True
+        self.report["aborted"][category] = found
+        logging.error(
+            f"Orphan collection skipped {category}: {found} of {scanned} look orphaned, more than "
+            f"{self.max_orphan_fraction:.0%}; check the storage and database settings"
+        )
+        return False
+    
+    def _batches(self, items):
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
+    
+    async def _stored_objects(self, prefix):
+        """Batches of (key, size, mtime) under `prefix`, in key order."""
+        objects = storage.list(prefix)
+        while True:
+            await self.limiter.wait()
+            batch = await anyio.to_thread.run_sync(lambda: list(itertools.islice(objects, self.batch_size)))
+            if not batch:
+                return
+            yield batch
+    
+    async def _documents(self, collection, projection, key='id'):
+        """Batches of documents ordered by `key`, fetched by keyset so each batch is one indexed query."""
+        last = None
+        while True:
+            await self.limiter.wait()
+            query = {key: {"$gt": last}} if last is not None else {}
+            batch = await collection.find(query, {"_id": 0, key: 1, **projection}).sort(key, 1).to_list(
+                self.batch_size
+            )
+            if not batch:
+                return
+            yield batch
+            last = batch[-1][key]
+    
+    async def _delete_objects(self, keys):
+        for batch in self._batches(keys):
+            await self.limiter.wait(len(batch))
+            await anyio.to_thread.run_sync(functools.partial(storage.delete, *batch))
+    
+    async def _missing_objects(self, keys):
+        """The subset of `keys` that is not in storage."""
+        missing = set()
+        for key in keys:
+            await self.limiter.wait()
+            if not await anyio.to_thread.run_sync(storage.exists, key):
+                missing.add(key)
+        return missing
+    
+    async def collect_photo_blobs(self):
+        """Blob records with no photo left pointing at their content."""
+        cutoff = datetime.now(timezone.utc).timestamp() - self.min_age
+        projection = {"filename": 1, "ref_count": 1, "created_at": 1}
+        scanned, orphans = 0, []
+        async for blobs in self._documents(db.photo_blobs, projection, key='hash'):
+            await self.limiter.wait()
+            scanned += len(blobs)
+            hashes = [blob['hash'] for blob in blobs]
+            used = set(await db.photos.distinct("content_hash", {"content_hash": {"$in": hashes}}))
+            orphans.extend(
+                blob for blob in blobs
+                if blob['hash'] not in used and blob['created_at'].timestamp() < cutoff
+            )
+        if not orphans or not self._within_limit("photo_blobs", len(orphans), scanned):
+            return
+        self._found("photo_blobs", "photo blob", [blob['hash'] for blob in orphans])
+        if self.dry_run:
+            return
+        for blob in orphans:
+            # Skipped if an upload took a reference since the blob was read
+            await self.limiter.wait()
+            await delete_photo_blob(blob['hash'], {"ref_count": blob['ref_count']})
+    
+    async def collect_photo_files(self):
+        """Stored photos and renditions that no photo record or blob refers to."""
+        scanned, orphans = 0, []
+        group = []
+        async for batch in self._stored_objects(PHOTO_PREFIX):
+            # A photo's keys sort together; the last group may continue in the next batch
+            groups = [
+                list(keys) for _, keys in itertools.groupby(group + batch, key=lambda o: photo_file_stem(o[0]))
+            ]
+            group = groups.pop()
+            scanned += len(groups)
+            orphans.extend(await self._orphaned_photo_groups(groups))
+        if group:
+            scanned += 1
+            orphans.extend(await self._orphaned_photo_groups([group]))
+        if not orphans or not self._within_limit("photo_files", len(orphans), scanned):
+            return
+        keys = [key for orphan in orphans for key, _, _ in orphan]
+        self._found("photo_files", "photo file", keys)
+        self.report["photo_file_bytes"] += sum(size for orphan in orphans for _, size, _ in orphan)
+        if not self.dry_run:
+            await self._delete_objects(keys)
+    
+    async def _orphaned_photo_groups(self, groups):
+        """The groups of keys, one group per stored photo, that nothing refers to."""
+        cutoff = time.time() - self.min_age
+        stems = [photo_file_stem(group[0][0]) for group in groups]
+        originals = [key for group in groups for key, _, _ in group if Path(key).stem == photo_file_stem(key)]
+        await self.limiter.wait(2)
+        used = {
+            Path(photo['storage_key']).stem
+            for photo in await db.photos.find(
+                {"storage_key": {"$in": originals}}, {"_id": 0, "storage_key": 1}
+            ).to_list(None)
+        }
+        used.update(await db.photo_blobs.distinct("hash", {"hash": {"$in": stems}}))
+        return [
+            group for stem, group in zip(stems, groups)
+            if stem not in used and all(mtime < cutoff for _, _, mtime in group)
+        ]
+    
+    async def collect_photo_records(self):
+        """Photo records whose stored file is gone."""
+        cutoff = datetime.now(timezone.utc).timestamp() - self.min_age
+        projection = {"filename": 1, "storage_key": 1, "content_hash": 1, "uploaded_at": 1}
+        scanned, orphans = 0, []
+        async for photos in self._documents(db.photos, projection):
+            photos = [photo for photo in photos if photo['uploaded_at'].timestamp() < cutoff]
+            scanned += len(photos)
+            missing = await self._missing_objects({photo['storage_key'] for photo in photos})
+            orphans.extend(photo for photo in photos if photo['storage_key'] in missing)
+        if not orphans or not self._within_limit("photo_records", len(orphans), scanned):
+            return
+        self._found("photo_records", "photo record", [photo['id'] for photo in orphans], self.delete_records)
+        if self.delete_records and not self.dry_run:
+            for batch in self._batches(orphans):
+                await self.limiter.wait(3)
+                await delete_photo_records(batch)
+    
+    async def collect_letterhead_files(self):
+        """Stored letterheads that no letterhead record refers to."""
+        cutoff = time.time() - self.min_age
+        scanned, orphans = 0, []
+        async for batch in self._stored_objects(LETTERHEAD_PREFIX):
+            await self.limiter.wait()
+            scanned += len(batch)
+            used = set(await db.letterheads.distinct(
+                "storage_key", {"storage_key": {"$in": [key for key, _, _ in batch]}}
+            ))
+            orphans.extend((key, size) for key, size, mtime in batch if key not in used and mtime < cutoff)
+        if not orphans or not self._within_limit("letterhead_files", len(orphans), scanned):
+            return
+        self._found("letterhead_files", "letterhead file", [key for key, _ in orphans])
+        self.report["letterhead_file_bytes"] += sum(size for _, size in orphans)
+        if not self.dry_run:
+            await self._delete_objects([key for key, _ in orphans])
+    
+    async def collect_letterhead_records(self):
+        """Letterhead records whose stored file is gone."""
+        cutoff = datetime.now(timezone.utc).timestamp() - self.min_age
+        scanned, orphan_ids = 0, []
+        async for letterheads in self._documents(db.letterheads, {"storage_key": 1, "uploaded_at": 1}):
+            letterheads = [lh for lh in letterheads if lh['uploaded_at'].timestamp() < cutoff]
+            scanned += len(letterheads)
+            missing = await self._missing_objects({lh['storage_key'] for lh in letterheads})
+            orphan_ids.extend(lh['id'] for lh in letterheads if lh['storage_key'] in missing)
+        if not orphan_ids or not self._within_limit("letterhead_records", len(orphan_ids), scanned):
+            return
+        self._found("letterhead_records", "letterhead record", orphan_ids, self.delete_records)
+        if self.delete_records and not self.dry_run:
+            for batch in self._batches(orphan_ids):
+                await self.limiter.wait()
+                await db.letterheads.delete_many({"id": {"$in": batch}})
+                letterhead_cache.invalidate(*batch)
+    
+    async def collect_project_references(self):
+        """Project references to photos, letterheads and PDFs that no longer exist."""
+        projection = {"photo_ids": 1, "letterhead_id": 1, "pdf_key": 1}
+        async for projects in self._documents(db.collage_projects, projection):
+            photo_ids = list({photo_id for project in projects for photo_id in project.get('photo_ids') or []})
+            letterhead_ids = list({project['letterhead_id'] for project in projects if project.get('letterhead_id')})
+            await self.limiter.wait(2)
+            photos = set(await db.photos.distinct("id", {"id": {"$in": photo_ids}}))
+            letterheads = set(await db.letterheads.distinct("id", {"id": {"$in": letterhead_ids}}))
+            missing_pdfs = await self._missing_objects(
+                {project['pdf_key'] for project in projects if project.get('pdf_key')}
+            )
+            
+            for project in projects:
+                update = {}
+                stale_photos = [photo_id for photo_id in project.get('photo_ids') or [] if photo_id not in photos]
+                if stale_photos:
+                    update["$pullAll"] = {"photo_ids": stale_photos}
+                unset = {}
+                if project.get('letterhead_id') and project['letterhead_id'] not in letterheads:
+                    unset["letterhead_id"] = ""
+                if project.get('pdf_key') in missing_pdfs:
+                    unset["pdf_key"] = ""
+                if unset:
+                    update["$unset"] = unset
+                if not update:
+                    continue
+                self._found("project_references", "project reference", [
+                    f"{project['id']}: {', '.join(stale_photos + list(unset))}"
+                ])
+                if not self.dry_run:
+                    await self.limiter.wait()
+                    await db.collage_projects.update_one({"id": project['id']}, update)
+
+gc_state = {"running": False, "last_report": None}
+_gc_lock = asyncio.Lock()
+
+async def collect_orphans(dry_run=GC_DRY_RUN, delete_records=GC_DELETE_RECORDS):
+    async with _gc_lock:
+        gc_state["running"] = True
+        try:
+            report = await OrphanCollector(dry_run=dry_run, delete_records=delete_records).run()
+            gc_state["last_report"] = report
+            logging.info(f"Orphan collection finished: {report}")
+            return report
+        finally:
+            gc_state["running"] = False
+
+async def collect_orphans_periodically():
+    while True:
+        await asyncio.sleep(GC_INTERVAL)
+        try:
+            await collect_orphans()
+        except Exception as e:
+            logging.error(f"Orphan collection failed: {e}")
+
+@api_router.get("/system/gc")
+async def get_gc_status():
+    return gc_state
+
+@api_router.post("/system/gc", status_code=202)
+async def start_gc(dry_run: bool = True, delete_records: bool = GC_DELETE_RECORDS):
+    """Start an orphan collection pass; dry runs only report what would be removed."""
+    if gc_state["running"]:
+        raise HTTPException(status_code=409, detail="Orphan collection is already running")
+    task = asyncio.create_task(collect_orphans(dry_run, delete_records))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return {"message": "Orphan collection started", "dry_run": dry_run, "delete_records": delete_records}
+
+# ZIP import and export
+IMPORT_BATCH_SIZE = 100  # archive entries stored per insert_many
+ZIP_CHUNK_SIZE = 256 * 1024
+
+def is_importable_entry(info: zipfile.ZipInfo):
+    name = Path(info.filename).name
+    if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+        return False
+    return (mimetypes.guess_type(name)[0] or '').startswith('image/')
+
+@api_router.post("/photos/import", response_model=List[PhotoUploadResult])
+async def import_photos_zip(background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                            project_id: Optional[str] = None):
+    """Import every image in a ZIP archive, optionally appending them to a project.
+
+    Entries are decompressed chunk by chunk straight into photo storage; the
+    archive itself is never extracted.
+    """
+    if project_id and not await db.collage_projects.find_one({"id": project_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        archive = zipfile.ZipFile(file.file)
+    except (zipfile.BadZipFile, OSError):
+        raise HTTPException(status_code=400, detail="Invalid ZIP archive")
+    
+    results = []
+    with archive:
+        entries = [info for info in archive.infolist() if is_importable_entry(info)]
+        semaphore = batch_semaphore()
+        
+        async def ingest(info):
+            async with semaphore:
+                entry = UploadFile(archive.open(info), filename=Path(info.filename).name, size=info.file_size)
+                try:
+                    return PhotoUploadResult(filename=info.filename, photo=await ingest_photo(entry))
+                except HTTPException as e:
+                    return PhotoUploadResult(filename=info.filename, error=str(e.detail))
+                except Exception as e:
+                    logging.error(f"Error importing {info.filename}: {e}")
+                    return PhotoUploadResult(filename=info.filename, error=str(e))
+                finally:
+                    await entry.close()
+        
+        for start in range(0, len(entries), IMPORT_BATCH_SIZE):
+            batch = await asyncio.gather(*(ingest(info) for info in entries[start:start + IMPORT_BATCH_SIZE]))
+            results.extend(batch)
+            try:
+                photos = await insert_photo_results(batch)
+            except Exception as e:
+                # Which photos were saved is unknown, so nothing is released; the orphan collector reconciles
+                raise HTTPException(status_code=500, detail=str(e))
+            pending = [photo for photo in photos if not photo.renditions]
+            if pending:
+                background_tasks.add_task(create_batch_renditions, pending)
+    
+    imported_ids = [result.photo.id for result in results if result.photo]
+    if project_id and imported_ids:
+        await db.collage_projects.update_one(
+            {"id": project_id}, {"$push": {"photo_ids": {"$each": imported_ids}}}
+        )
+    return results
+
+class ZipChunkStream(io.RawIOBase):
+    """Write-only sink for zipfile that hands back what was written since the last drain."""
+    def __init__(self):
+        self._chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip_archive(entries):
+    """Yield a ZIP archive of (name, object key or bytes) entries as it is written.
+
+    Files are read in ZIP_CHUNK_SIZE pieces and stored uncompressed (photos
+    and PDFs are already compressed), so memory use does not depend on the
+    size of the archive.
+    """
+    stream = ZipChunkStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, source in entries:
+            if isinstance(source, bytes):
+                archive.writestr(name, source)
+            else:
+                try:
+                    with storage.open(source) as f, archive.open(name, 'w', force_zip64=True) as entry:
+                        while chunk := f.read(ZIP_CHUNK_SIZE):
+                            entry.write(chunk)
+                            yield stream.drain()
+                except FileNotFoundError:
+                    logging.error(f"Skipping missing file {source} in ZIP export")
+            yield stream.drain()
+    yield stream.drain()
+
+@api_router.get("/projects/{project_id}/export")
+async def export_project_zip(project_id: str):
+    """Stream a project's photos, its generated PDF and a project.json manifest as a ZIP."""
+    project = await db.collage_projects.find_one({"id": project_id}, {"_id": 0})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    project = CollageProject(**project)
+    
+    photos = await db.photos.find({"id": {"$in": project.photo_ids}}, {"_id": 0}).to_list(None)
+    photos_by_id = {photo['id']: PhotoMetadata(**photo) for photo in photos}
+    
+    entries = []
+    manifest_photos = []
+    for index, photo_id in enumerate(project.photo_ids):
+        photo = photos_by_id.get(photo_id)
+        if photo is None:
+            continue
+        name = f"photos/{index + 1:04d}_{Path(photo.original_filename).name or photo.filename}"
+        entries.append((name, photo.storage_key))
+        manifest_photos.append({**photo.model_dump(mode='json'), "archive_path": name})
+    if project.pdf_key and await anyio.to_thread.run_sync(storage.exists, project.pdf_key):
+        entries.append(("collage.pdf", project.pdf_key))
+    
+    manifest = {"project": project.model_dump(mode='json'), "photos": manifest_photos}
+    entries.insert(0, ("project.json", json.dumps(manifest, indent=2).encode()))
+    
+    # A sync iterator, so Starlette reads objects and writes the archive in its threadpool
+    return StreamingResponse(
+        (chunk for chunk in iter_zip_archive(entries) if chunk),
+        media_type='application/zip',
+        headers={"Content-Disposition": f'attachment; filename="project-{project_id}.zip"'}
+    )
+
+# Metrics endpoint
+# Component stats are exported as gauges under their /api/system/status names
+register_component_stats({
+    "worker_pool": worker_pool.stats,
+    "render_cache": render_cache.stats,
+    "memory_budget": memory_budget.stats,
+    "photo_cache": photo_cache.stats,
+    "letterhead_cache": letterhead_cache.stats,
+})
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    body, content_type = render_metrics()
+    return Response(body, headers={"Content-Type": content_type})
+
+# System status
+@api_router.get("/system/status")
+async def get_system_status():
+    return {
+        "worker_pool": worker_pool.stats(),
+        "render_cache": render_cache.stats(),
+        "memory_budget": memory_budget.stats(),
+        "metadata_cache": {"photos": photo_cache.stats(), "letterheads": letterhead_cache.stats()},
+    }
 
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -325,6 +2688,71 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def migrate_uploaded_at(collection, batch_size=500):
+    """Convert uploaded_at values stored as ISO strings into BSON dates."""
+    updates = []
+    async for doc in collection.find({"uploaded_at": {"$type": "string"}}, {"_id": 1, "uploaded_at": 1}):
+        updates.append(UpdateOne(
+            {"_id": doc['_id']},
+            {"$set": {"uploaded_at": datetime.fromisoformat(doc['uploaded_at'])}}
+        ))
+        if len(updates) >= batch_size:
+            await collection.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+
+async def migrate_storage_keys(collection, path_field, key_field, prefix, batch_size=500):
+    """Replace filesystem paths recorded by older versions with object keys."""
+    updates = []
+    async for doc in collection.find({path_field: {"$exists": True}}, {"_id": 1, path_field: 1}):
+        updates.append(UpdateOne(
+            {"_id": doc['_id']},
+            {
+                "$set": {key_field: object_key(prefix, Path(doc[path_field]).name)},
+                "$unset": {path_field: ""},
+            }
+        ))
+        if len(updates) >= batch_size:
+            await collection.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+
+@app.on_event("startup")
+async def prepare_database():
+    await migrate_storage_keys(db.photos, 'file_path', 'storage_key', PHOTO_PREFIX)
+    await migrate_storage_keys(db.letterheads, 'file_path', 'storage_key', LETTERHEAD_PREFIX)
+    await migrate_storage_keys(db.collage_projects, 'pdf_path', 'pdf_key', PDF_PREFIX)
+    for collection in (db.photos, db.letterheads):
+        await migrate_uploaded_at(collection)
+        await collection.create_index("id", unique=True)
+        await collection.create_index([("uploaded_at", 1), ("id", 1)])
+    await db.collage_projects.create_index("id", unique=True)
+    await db.collage_projects.create_index([("created_at", 1), ("id", 1)])
+    await db.photos.create_index("content_hash")
+    await db.photos.create_index("storage_key")
+    await db.letterheads.create_index("storage_key")
+    await db.pdf_jobs.create_index("id", unique=True)
+    # Job records expire with the PDFs they point at
+    await db.pdf_jobs.create_index("finished_at", expireAfterSeconds=int(PDF_RETENTION_SECONDS))
+    await fail_interrupted_pdf_jobs()
+    # Concurrent uploads of the same content upsert one blob record
+    await db.photo_blobs.create_index("hash", unique=True)
+
+_background_tasks = set()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    task = asyncio.create_task(sweep_pdfs_periodically())
+    _background_tasks.add(task)
+    if GC_INTERVAL > 0:
+        task = asyncio.create_task(collect_orphans_periodically())
+        _background_tasks.add(task)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    for task in _background_tasks:
+        task.cancel()
+    client.close()
+    worker_pool.shutdown()
\ No newline at end of file
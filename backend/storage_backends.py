@@ -0,0 +1,226 @@
+# Storage backends
+# Stored files are addressed by object keys ("photos/<hash>.jpg",
+# "letterheads/<id>.png", "pdfs/<id>.pdf") and Mongo records the key, never a
+# path. The server's upload directories stay as node-local staging space.
+import mimetypes
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import boto3
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+
+PHOTO_PREFIX = 'photos'
+LETTERHEAD_PREFIX = 'letterheads'
+PDF_PREFIX = 'pdfs'
+
+def object_key(prefix, filename):
+    return f"{prefix}/{filename}"
+
+class LocalStorage:
+    """Objects stored as files under `root`, served by the API itself."""
+    kind = 'local'
+    
+    def __init__(self, root):
+        self.root = Path(root).resolve()
+    
+    def local_path(self, key):
+        """Filesystem path holding the object, for decoding in place."""
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+    
+    def put_file(self, key, source_path, content_type=None):
+        """Move a local file into storage under `key`."""
+        path = self.local_path(key)
+        if Path(source_path).resolve() != path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source_path, path)
+    
+    def exists(self, key):
+        return self.local_path(key).is_file()
+    
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+    
+    def delete(self, *keys):
+        for key in keys:
+            self.local_path(key).unlink(missing_ok=True)
+    
+    def list(self, prefix):
+        """Yield (key, size, modified timestamp) for objects under `prefix`, in key order."""
+        for path in sorted((self.root / prefix).glob('*')):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file() and not path.name.startswith('.'):
+                yield object_key(prefix, path.name), stat.st_size, stat.st_mtime
+    
+    def download_url(self, key, media_type=None, filename=None, cache_control=None):
+        return None
+    
+    def trim_cache(self):
+        return 0
+
+class S3Storage:
+    """Objects in an S3-compatible bucket (AWS S3, MinIO, ...).
+
+    Downloads are redirected to presigned URLs, so file bytes never pass
+    through the API. Objects that have to be decoded here are copied into a
+    node-local cache directory, trimmed to `cache_bytes`; stored keys are
+    content-addressed or unique, so cached copies never go stale.
+    """
+    kind = 's3'
+    
+    def __init__(self, bucket, cache_dir, prefix='', endpoint_url=None, region=None, public_endpoint_url=None,
+                 presign_expiry=3600, cache_bytes=2048 * 1024 * 1024):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.public_endpoint_url = public_endpoint_url or endpoint_url
+        self.presign_expiry = presign_expiry
+        self.cache_dir = Path(cache_dir)
+        self.cache_bytes = cache_bytes
+        self._clients = {}
+        self._lock = threading.Lock()
+    
+    def _client(self, endpoint_url=None):
+        endpoint_url = endpoint_url or self.endpoint_url
+        with self._lock:
+            if endpoint_url not in self._clients:
+                # Path-style addressing is what MinIO and most S3 stand-ins expect
+                config = BotoConfig(
+                    signature_version='s3v4',
+                    s3={'addressing_style': 'path' if endpoint_url else 'auto'},
+                )
+                self._clients[endpoint_url] = boto3.client(
+                    's3', endpoint_url=endpoint_url, region_name=self.region, config=config
+                )
+            return self._clients[endpoint_url]
+    
+    def _object(self, key):
+        return f"{self.prefix}{key}"
+    
+    def _cache_path(self, key):
+        path = (self.cache_dir / key).resolve()
+        if self.cache_dir.resolve() not in path.parents:
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+    
+    def local_path(self, key):
+        path = self._cache_path(key)
+        if path.is_file():
+            os.utime(path)
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part = path.with_name(f".{uuid.uuid4()}.part")
+        try:
+            self._client().download_file(self.bucket, self._object(key), str(part))
+            os.replace(part, path)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(key)
+            raise
+        finally:
+            part.unlink(missing_ok=True)
+        return path
+    
+    def put_file(self, key, source_path, content_type=None):
+        content_type = content_type or mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        self._client().upload_file(
+            str(source_path), self.bucket, self._object(key), ExtraArgs={"ContentType": content_type}
+        )
+        # Keep the bytes locally as well; the next decode of this object is free
+        path = self._cache_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source_path, path)
+    
+    def exists(self, key):
+        try:
+            self._client().head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+    
+    def open(self, key):
+        try:
+            return self._client().get_object(Bucket=self.bucket, Key=self._object(key))['Body']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(key)
+            raise
+    
+    def delete(self, *keys):
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            self._client().delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": self._object(key)} for key in batch], "Quiet": True},
+            )
+            for key in batch:
+                self._cache_path(key).unlink(missing_ok=True)
+    
+    def list(self, prefix):
+        paginator = self._client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object(f"{prefix}/")):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp()
+    
+    def download_url(self, key, media_type=None, filename=None, cache_control=None):
+        params = {"Bucket": self.bucket, "Key": self._object(key)}
+        if media_type:
+            params["ResponseContentType"] = media_type
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        if cache_control:
+            params["ResponseCacheControl"] = cache_control
+        return self._client(self.public_endpoint_url).generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=self.presign_expiry
+        )
+    
+    def trim_cache(self):
+        """Drop least recently used cached objects until the cache fits; returns bytes freed.
+
+        Downloads still in progress (dotfiles) are left alone.
+        """
+        files = []
+        for path in self.cache_dir.rglob('*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file() and not path.name.startswith('.'):
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        freed = 0
+        for _, size, path in sorted(files):
+            if total - freed <= self.cache_bytes:
+                break
+            path.unlink(missing_ok=True)
+            freed += size
+        return freed
+
+def create_storage(local_root, cache_dir):
+    """The backend selected by STORAGE_BACKEND: files under `local_root`, or S3 cached in `cache_dir`."""
+    backend = os.environ.get('STORAGE_BACKEND', 'local')
+    if backend == 's3':
+        return S3Storage(
+            bucket=os.environ['S3_BUCKET'],
+            cache_dir=cache_dir,
+            prefix=os.environ.get('S3_PREFIX', ''),
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+            region=os.environ.get('S3_REGION') or None,
+            public_endpoint_url=os.environ.get('S3_PUBLIC_ENDPOINT_URL') or None,
+            presign_expiry=int(os.environ.get('S3_PRESIGN_EXPIRY', 3600)),
+            cache_bytes=int(float(os.environ.get('STORAGE_CACHE_MB', 2048)) * 1024 * 1024),
+        )
+    if backend != 'local':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return LocalStorage(local_root)
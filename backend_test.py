@@ -1,5 +1,6 @@
 import requests
 import sys
+import time
 import os
 import base64
 from datetime import datetime
@@ -97,6 +98,30 @@ class CollageAPITester:
             print(f"Error in photo upload test: {e}")
             return None
 
+    def test_batch_upload(self):
+        """Test batch photo upload with one invalid file"""
+        files = [
+            ('files', ('batch_1.png', self.create_test_image(), 'image/png')),
+            ('files', ('batch_2.png', self.create_test_image(), 'image/png')),
+            ('files', ('not_an_image.png', b'not an image', 'image/png')),
+        ]
+        
+        success, response = self.run_test(
+            "Batch Photo Upload",
+            "POST",
+            "photos/upload/batch",
+            200,
+            files=files
+        )
+        
+        if success:
+            uploaded = [result['photo'] for result in response if result.get('photo')]
+            failed = [result for result in response if result.get('error')]
+            print(f"   Uploaded: {len(uploaded)}, failed: {len(failed)}")
+            self.uploaded_photos.extend(uploaded)
+            return [photo['id'] for photo in uploaded]
+        return []
+
     def test_get_photos(self):
         """Test getting all photos"""
         success, response = self.run_test(
@@ -117,6 +142,16 @@ class CollageAPITester:
         )
         return success
 
+    def test_get_photo_thumbnail(self, photo_id):
+        """Test getting a downscaled photo rendition"""
+        success, _ = self.run_test(
+            "Get Photo Thumbnail",
+            "GET",
+            f"photos/{photo_id}/file?size=256&format=webp",
+            200
+        )
+        return success
+
     def test_letterhead_upload(self):
         """Test letterhead upload"""
         try:
@@ -172,6 +207,33 @@ class CollageAPITester:
         )
         return success
 
+    def test_photo_edits(self, photo_id):
+        """Test applying a stacked edit recipe to a stored photo"""
+        test_data = {
+            "operations": [
+                {"operation": "rotate", "value": 90},
+                {"operation": "brightness", "value": 1.2},
+                {"operation": "sharpen"}
+            ]
+        }
+        
+        url = f"{self.api_url}/photos/{photo_id}/edits"
+        self.tests_run += 1
+        print("\n🔍 Testing Photo Edits...")
+        print(f"   URL: {url}")
+        
+        try:
+            response = requests.put(url, json=test_data)
+            if response.status_code == 200 and response.json().get('url'):
+                self.tests_passed += 1
+                print(f"✅ Passed - Status: {response.status_code}")
+                return True
+            print(f"❌ Failed - Expected 200, got {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
     def test_pdf_generation(self):
         """Test PDF generation"""
         if not self.uploaded_photos:
@@ -204,6 +266,62 @@ class CollageAPITester:
         )
         return success
 
+    def test_layout_pdf_generation(self):
+        """Test server-side layout rendering from photo IDs"""
+        if not self.uploaded_photos:
+            print("⚠️  Skipping layout PDF generation test - no uploaded photos")
+            return False
+            
+        test_data = {
+            "project_id": "test-project-123",
+            "layout": "2x2",
+            "photo_ids": [photo['id'] for photo in self.uploaded_photos],
+            "fit_mode": "contain"
+        }
+        
+        success, response = self.run_test(
+            "PDF Generation - Server Layout",
+            "POST",
+            "pdf/generate",
+            200,
+            data=test_data
+        )
+        return success
+
+    def test_pdf_job(self):
+        """Test asynchronous PDF export with status polling"""
+        if not self.uploaded_photos:
+            print("⚠️  Skipping PDF job test - no uploaded photos")
+            return False
+        
+        test_data = {
+            "project_id": "test-project-123",
+            "layout": "2x2",
+            "photo_ids": [photo['id'] for photo in self.uploaded_photos]
+        }
+        
+        success, response = self.run_test(
+            "PDF Job Submit",
+            "POST",
+            "pdf/jobs",
+            202,
+            data=test_data
+        )
+        if not success or 'id' not in response:
+            return False
+        
+        for _ in range(30):
+            success, job = self.run_test(
+                "PDF Job Status",
+                "GET",
+                f"pdf/jobs/{response['id']}",
+                200
+            )
+            if not success or job.get('status') in ('done', 'failed'):
+                break
+            time.sleep(1)
+        return success and job.get('status') == 'done'
+
     def test_delete_photo(self, photo_id):
         """Test photo deletion"""
         success, _ = self.run_test(
@@ -214,6 +332,20 @@ class CollageAPITester:
         )
         return success
 
+    def test_bulk_delete_photos(self, photo_ids):
+        """Test deleting several photos in one request"""
+        success, response = self.run_test(
+            "Bulk Delete Photos",
+            "POST",
+            "photos/delete",
+            200,
+            data={"photo_ids": photo_ids + ["missing-photo-id"]}
+        )
+        
+        if success:
+            print(f"   Deleted: {len(response['deleted'])}, not found: {len(response['not_found'])}")
+        return success
+
 def main():
     print("🚀 Starting Photo Collage API Tests")
     print("=" * 50)
@@ -224,12 +356,15 @@ def main():
     # Test photo upload
     photo_id = tester.test_photo_upload()
     
+    batch_photo_ids = tester.test_batch_upload()
+    
     # Test getting photos
     tester.test_get_photos()
     
     # Test getting photo file if we have a photo
     if photo_id:
         tester.test_get_photo_file(photo_id)
+        tester.test_get_photo_thumbnail(photo_id)
     
     # Test letterhead upload
     letterhead_id = tester.test_letterhead_upload()
@@ -239,13 +374,19 @@ def main():
     
     # Test image processing
     tester.test_image_processing()
+    if photo_id:
+        tester.test_photo_edits(photo_id)
     
     # Test PDF generation
     tester.test_pdf_generation()
+    tester.test_layout_pdf_generation()
+    tester.test_pdf_job()
     
     # Test photo deletion if we have a photo
     if photo_id:
         tester.test_delete_photo(photo_id)
+    if batch_photo_ids:
+        tester.test_bulk_delete_photos(batch_photo_ids)
     
     # Print results
     print("\n" + "=" * 50)
@@ -93,20 +93,23 @@ const CollageEditor = () => {
   // Handle photo upload
   const onDrop = useCallback(async (acceptedFiles) => {
     setUploading(true);
-    for (const file of acceptedFiles) {
-      try {
-        const formData = new FormData();
-        formData.append('file', file);
-        
-        await axios.post(`${API}/photos/upload`, formData, {
-          headers: { 'Content-Type': 'multipart/form-data' },
-        });
-        
-        toast.success(`${file.name} berhasil diupload`);
-      } catch (error) {
-        console.error('Error uploading photo:', error);
-        toast.error(`Gagal upload ${file.name}`);
+    try {
+      const formData = new FormData();
+      acceptedFiles.forEach((file) => formData.append('files', file));
+      
+      const response = await axios.post(`${API}/photos/upload/batch`, formData, {
+        headers: { 'Content-Type': 'multipart/form-data' },
+      });
+      
+      const failed = response.data.filter((result) => result.error);
+      const uploaded = response.data.length - failed.length;
+      if (uploaded > 0) {
+        toast.success(`${uploaded} foto berhasil diupload`);
       }
+      failed.forEach((result) => toast.error(`Gagal upload ${result.filename}`));
+    } catch (error) {
+      console.error('Error uploading photos:', error);
+      toast.error('Gagal upload foto');
     }
     setUploading(false);
     fetchPhotos();
@@ -457,7 +460,7 @@ const CollageEditor = () => {
                         >
                           <div className="relative flex-shrink-0">
                             <img
-                              src={`${API}/photos/${photo.id}/file`}
+                              src={`${API}/photos/${photo.id}/file?size=256`}
                               alt={photo.original_filename}
                               className="w-14 h-14 object-cover rounded-lg shadow-sm"
                             />
@@ -982,7 +985,7 @@ const CollageEditor = () => {
                           onClick={() => setSelectedPhoto(photo)}
                         >
                           <img
-                            src={`${API}/photos/${photo.id}/file`}
+                            src={`${API}/photos/${photo.id}/file?size=1024`}
                             alt={photo.original_filename}
                             className={`w-full h-full group-hover:scale-110 transition-transform duration-300 ${
                               imageObjectFit === 'cover' ? 'object-cover' : 'object-contain bg-gray-50'
@@ -0,0 +1,422 @@
+"""Offline performance benchmark for the collage backend.
+
+Runs the FastAPI app in-process through httpx's ASGI transport, against an
+in-memory Mongo stand-in (mongomock-motor) or a local MongoDB, with
+synthetic photo corpora. Reports throughput, p50/p99 latency and peak RSS
+for the upload, file, process, edit, PDF export and ZIP export paths,
+covering every layout in the editor's layoutTemplates.
+
+    python performance_benchmark.py                          # run and print the results
+    python performance_benchmark.py --save-baseline base.json
+    python performance_benchmark.py --baseline base.json     # exit 1 on regressions
+
+Baselines are only comparable on the same machine with the same options.
+The server module is loaded from a temporary copy, so uploads, renders and
+caches go to a scratch directory instead of backend/uploads. The ASGI
+transport waits for background tasks, so upload latency includes
+rendition generation.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import PIL
+from PIL import Image
+
+ROOT_DIR = Path(__file__).parent
+SERVER_PATH = ROOT_DIR / 'backend' / 'server.py'
+EDITOR_PATH = ROOT_DIR / 'frontend' / 'src' / 'components' / 'CollageEditor.jsx'
+
+PHOTO_SIZES = {'small': (640, 480), 'medium': (2048, 1536), 'large': (4032, 3024)}
+PHOTO_FORMATS = {'JPEG': ('jpg', 'image/jpeg'), 'PNG': ('png', 'image/png'), 'WEBP': ('webp', 'image/webp')}
+PROCESS_OPERATIONS = [
+    ('rotate', 90), ('brightness', 1.2), ('contrast', 1.2), ('blur', 2), ('sharpen', None), ('grayscale', None),
+]
+COMPARED_METRICS = (('p50_ms', 'higher'), ('p99_ms', 'higher'), ('throughput_rps', 'lower'), ('peak_rss_mb', 'higher'))
+
+def synthetic_photo(width, height, image_format, seed):
+    """A deterministic photo-like image: smooth colour fields plus fine grain, so it compresses like a photo."""
+    rng = random.Random(seed)
+    smooth = Image.frombytes('RGB', (32, 24), rng.randbytes(32 * 24 * 3)).resize((width, height), Image.BICUBIC)
+    grain = Image.frombytes('L', (width, height), rng.randbytes(width * height)).convert('RGB')
+    img = Image.blend(smooth, grain, 0.1)
+    buffer = io.BytesIO()
+    options = {'quality': 90} if image_format in ('JPEG', 'WEBP') else {}
+    img.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+def data_url(data, media_type='image/jpeg'):
+    return f"data:{media_type};base64,{base64.b64encode(data).decode()}"
+
+def percentile(sorted_values, fraction):
+    """Linearly interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def editor_layouts():
+    """Layout ids from the editor's layoutTemplates, or None when the frontend is not checked out."""
+    if not EDITOR_PATH.exists():
+        return None
+    source = EDITOR_PATH.read_text()
+    match = re.search(r'const layoutTemplates = \[(.*?)\];', source, re.S)
+    return re.findall(r"id: '([^']+)'", match.group(1)) if match else None
+
+def load_server(work_dir, mongo_url=None):
+    """Import a scratch copy of the backend modules, wired to mongomock unless a Mongo URL is given."""
+    os.environ['MONGO_URL'] = mongo_url or 'mongodb://localhost:27017'
+    os.environ['DB_NAME'] = f"collage_benchmark_{os.getpid()}"
+    os.environ['STORAGE_BACKEND'] = 'local'
+    for module in SERVER_PATH.parent.glob('*.py'):
+        shutil.copy(module, work_dir / module.name)
+    # Imported by name so a process worker pool can unpickle its functions
+    sys.path.insert(0, str(work_dir))
+    import server
+
+    if mongo_url is None:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is not installed; install it or pass --mongo-url")
+        server.client = AsyncMongoMockClient(tz_aware=True)
+        server.db = server.client[os.environ['DB_NAME']]
+    return server
+
+class RSSSampler:
+    """Samples this process's resident set size in a background thread and keeps the peak."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def rss(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # No procfs: fall back to the lifetime peak (KiB on Linux, bytes on macOS)
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == 'darwin' else peak * 1024
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+class PerformanceBenchmark:
+    def __init__(self, server, iterations=5, warmup=1, concurrency=1, quick=False, only=None):
+        self.server = server
+        self.iterations = iterations
+        self.warmup = warmup
+        self.concurrency = concurrency
+        self.quick = quick
+        self.only = re.compile(only) if only else None
+        self.results = {}
+        self.client = None
+        self.photo_pool = []  # ids of uploaded medium photos for file, edit and PDF scenarios
+        self._seed = 0
+
+    def next_seed(self):
+        self._seed += 1
+        return self._seed
+
+    def selected(self, name):
+        return self.only is None or self.only.search(name)
+
+    async def measure(self, name, make_requests, expected_status=200):
+        """Time requests produced by `make_requests()`; the first `warmup` are issued but not recorded."""
+        if not self.selected(name):
+            return
+        requests = make_requests()
+        for make_request in requests[:self.warmup]:
+            await make_request()
+        requests = requests[self.warmup:]
+
+        latencies = []
+        errors = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def issue(make_request):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await make_request()
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != expected_status:
+                    errors.append(f"{response.status_code} {response.text[:200]}")
+
+        with RSSSampler() as rss:
+            started = time.perf_counter()
+            await asyncio.gather(*(issue(make_request) for make_request in requests))
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        result = {
+            "requests": len(latencies),
+            "errors": len(errors),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "peak_rss_mb": round(rss.peak / (1024 * 1024), 1),
+        }
+        self.results[name] = result
+        print(
+            f"   {name:<40} {result['requests']:>4} req  p50 {result['p50_ms']:>9.2f} ms  "
+            f"p99 {result['p99_ms']:>9.2f} ms  {result['throughput_rps']:>8.2f} req/s  "
+            f"RSS {result['peak_rss_mb']:>7.1f} MB"
+        )
+        if errors:
+            print(f"   ❌ {len(errors)} unexpected responses, first: {errors[0]}")
+
+    def upload(self, data, image_format='JPEG'):
+        extension, media_type = PHOTO_FORMATS[image_format]
+        return self.client.post('/api/photos/upload', files={'file': (f"photo.{extension}", data, media_type)})
+
+    def request_count(self):
+        return self.iterations + self.warmup
+
+    async def setup_photo_pool(self):
+        """Upload the medium photos the file, edit and export scenarios work on (not timed)."""
+        width, height = PHOTO_SIZES['medium']
+        # Every PDF request gets its own photos, so layout tiles are rendered rather than served from cache
+        largest_layout = max(len(layout['cells']) for layout in self.server.COLLAGE_LAYOUTS.values())
+        count = max(largest_layout * self.request_count(), 16)
+        for _ in range(count):
+            response = await self.upload(synthetic_photo(width, height, 'JPEG', self.next_seed()))
+            response.raise_for_status()
+            self.photo_pool.append(response.json()['id'])
+
+    async def bench_uploads(self):
+        sizes = {'small': PHOTO_SIZES['small'], 'medium': PHOTO_SIZES['medium']} if self.quick else PHOTO_SIZES
+        for size_name, (width, height) in sizes.items():
+            for image_format in PHOTO_FORMATS:
+                name = f"upload {size_name} {image_format.lower()}"
+                await self.measure(name, lambda: [
+                    lambda data=synthetic_photo(width, height, image_format, self.next_seed()): self.upload(data, image_format)
+                    for _ in range(self.request_count())
+                ])
+
+        batch_size = 8
+        await self.measure("upload batch of 8 small jpeg", lambda: [
+            lambda files=[
+                ('files', (f"photo{i}.jpg", synthetic_photo(*PHOTO_SIZES['small'], 'JPEG', self.next_seed()), 'image/jpeg'))
+                for i in range(batch_size)
+            ]: self.client.post('/api/photos/upload/batch', files=files)
+            for _ in range(self.request_count())
+        ])
+
+    async def bench_photo_files(self):
+        photo_ids = self.photo_pool[:16]
+        for label, query in (('original', ''), ('256 jpeg', '?size=256'), ('1024 webp', '?size=1024&format=webp')):
+            await self.measure(f"photo file {label}", lambda: [
+                lambda photo_id=photo_id: self.client.get(f"/api/photos/{photo_id}/file{query}")
+                for photo_id in photo_ids
+            ])
+
+    async def bench_process(self):
+        width, height = PHOTO_SIZES['medium']
+        for operation, value in PROCESS_OPERATIONS:
+            # Distinct images per request, so results are not served from the render cache
+            await self.measure(f"process {operation}", lambda: [
+                lambda image=data_url(synthetic_photo(width, height, 'JPEG', self.next_seed())): self.client.post(
+                    '/api/photos/process', json={"image_data": image, "operation": operation, "value": value}
+                )
+                for _ in range(self.request_count())
+            ])
+
+    async def bench_edits(self):
+        photo_ids = self.photo_pool[:16]
+        operations = [{"operation": "brightness", "value": 1.1}, {"operation": "contrast", "value": 1.2}]
+        await self.measure("edits save", lambda: [
+            lambda photo_id=photo_id: self.client.put(f"/api/photos/{photo_id}/edits", json={"operations": operations})
+            for photo_id in photo_ids
+        ])
+        await self.measure("edits get rendered", lambda: [
+            lambda photo_id=photo_id: self.client.get(f"/api/photos/{photo_id}/edited")
+            for photo_id in photo_ids
+        ])
+        # Reset, so later scenarios draw the unedited photos
+        for photo_id in photo_ids:
+            await self.client.put(f"/api/photos/{photo_id}/edits", json={"operations": []})
+
+    async def bench_pdf_layouts(self, layouts):
+        for layout in layouts:
+            cells = len(self.server.COLLAGE_LAYOUTS[layout]['cells'])
+            await self.measure(f"pdf layout {layout}", lambda: [
+                lambda photo_ids=self.photo_pool[i * cells:(i + 1) * cells]: self.client.post('/api/pdf/generate', json={
+                    "project_id": "benchmark", "layout": layout, "photo_ids": photo_ids,
+                })
+                for i in range(self.request_count())
+            ])
+
+        width, height = PHOTO_SIZES['small']
+        await self.measure("pdf inline images", lambda: [
+            lambda images=[
+                {"data": data_url(synthetic_photo(width, height, 'JPEG', self.next_seed())),
+                 "x": 40 + (i % 2) * 260, "y": 60 + (i // 2) * 200, "width": 240, "height": 180}
+                for i in range(4)
+            ]: self.client.post('/api/pdf/generate', json={"project_id": "benchmark", "images": images})
+            for _ in range(self.request_count())
+        ])
+
+    async def bench_project_export(self):
+        project = self.server.CollageProject(id='benchmark', name='Benchmark', layout='4x4', photo_ids=self.photo_pool[:16])
+        await self.server.db.collage_projects.replace_one({"id": project.id}, project.model_dump(), upsert=True)
+        await self.measure("project zip export", lambda: [
+            lambda: self.client.get(f"/api/projects/{project.id}/export")
+            for _ in range(self.request_count())
+        ])
+
+    async def run_all(self, drop_database=False):
+        server_layouts = list(self.server.COLLAGE_LAYOUTS)
+        layouts = editor_layouts() or server_layouts
+        missing = [layout for layout in layouts if layout not in self.server.COLLAGE_LAYOUTS]
+        if missing:
+            print(f"⚠️  Editor layouts without a server layout, skipped: {', '.join(missing)}")
+            layouts = [layout for layout in layouts if layout not in missing]
+
+        await self.server.prepare_database()
+        transport = httpx.ASGITransport(app=self.server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=None) as client:
+            self.client = client
+            print("📦 Uploading the photo pool...")
+            await self.setup_photo_pool()
+
+            print("\n⏱️  Uploads")
+            await self.bench_uploads()
+            print("\n⏱️  Photo files")
+            await self.bench_photo_files()
+            print("\n⏱️  Image processing")
+            await self.bench_process()
+            print("\n⏱️  Edits")
+            await self.bench_edits()
+            print("\n⏱️  PDF export")
+            await self.bench_pdf_layouts(layouts)
+            print("\n⏱️  ZIP export")
+            await self.bench_project_export()
+        self.server.worker_pool.shutdown()
+        if drop_database:
+            await self.server.client.drop_database(self.server.db.name)
+        return self.results
+
+    def metadata(self):
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pillow": PIL.__version__,
+            "worker_pool": self.server.worker_pool.stats()['kind'],
+            "iterations": self.iterations,
+            "warmup": self.warmup,
+            "concurrency": self.concurrency,
+            "quick": self.quick,
+        }
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Print current results against a baseline; returns the regressions found."""
+    regressions = []
+    print(f"\n📈 Comparison with baseline from {baseline['meta'].get('created_at', 'unknown')}")
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"   {name:<40} (not in baseline)")
+            continue
+        changes = []
+        for metric, worse in COMPARED_METRICS:
+            if not base.get(metric):
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            regressed = change > tolerance if worse == 'higher' else change < -tolerance
+            changes.append(f"{metric} {change:+.0%}{' ❌' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{name}: {metric} {base[metric]} -> {result[metric]} ({change:+.0%})")
+        print(f"   {name:<40} {'  '.join(changes)}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=5, help='timed requests per scenario (default 5)')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed requests before each scenario (default 1)')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight at once (default 1)')
+    parser.add_argument('--quick', action='store_true', help='skip the large photo corpus')
+    parser.add_argument('--only', help='regular expression selecting scenarios by name')
+    parser.add_argument('--mongo-url', help='use this MongoDB instead of mongomock (a scratch database is dropped after)')
+    parser.add_argument('--baseline', help='baseline JSON to compare against; exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative change before a regression (default 0.2)')
+    parser.add_argument('--save-baseline', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    print("🚀 Starting Collage API Benchmark")
+    print("=" * 50)
+    work_dir = Path(tempfile.mkdtemp(prefix='collage-benchmark-'))
+    try:
+        server = load_server(work_dir, args.mongo_url)
+        benchmark = PerformanceBenchmark(
+            server, iterations=args.iterations, warmup=args.warmup, concurrency=args.concurrency,
+            quick=args.quick, only=args.only,
+        )
+        results = asyncio.run(benchmark.run_all(drop_database=bool(args.mongo_url)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"meta": benchmark.metadata(), "results": results}
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2))
+        print(f"\n💾 Baseline saved to {args.save_baseline}")
+
+    print("\n" + "=" * 50)
+    failed = [name for name, result in results.items() if result['errors']]
+    if failed:
+        print(f"❌ Unexpected responses in: {', '.join(failed)}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        mismatched = [
+            key for key in ('cpu_count', 'python', 'iterations', 'concurrency', 'quick', 'worker_pool')
+            if baseline['meta'].get(key) != report['meta'][key]
+        ]
+        if mismatched:
+            print(f"⚠️  Baseline was recorded with different {', '.join(mismatched)}; comparison is approximate")
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regressions beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"   • {regression}")
+            return 1
+        print("\n🎉 No regressions against the baseline")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test_database')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+import server  # noqa: E402
+import storage_backends  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """An in-memory database swapped in for the server's."""
+    database = AsyncMongoMockClient(tz_aware=True)['test_database']
+    monkeypatch.setattr(server, 'db', database)
+    return database
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    """Local storage rooted in a temporary directory."""
+    local = storage_backends.LocalStorage(tmp_path)
+    monkeypatch.setattr(server, 'storage', local)
+    return local
@@ -0,0 +1,83 @@
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+
+import server
+
+DATA = bytes(range(100))
+
+
+@pytest.mark.parametrize("header,expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=90-200", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=5-3", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-9", None),
+    ("bytes=a-b", None),
+])
+def test_parse_byte_range(header, expected):
+    assert server.parse_byte_range(header, len(DATA)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=-0", "bytes=500-600"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(HTTPException) as error:
+        server.parse_byte_range(header, len(DATA))
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */100"
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(DATA)
+    app = FastAPI()
+    
+    @app.get("/file")
+    def get_file(request: Request):
+        return server.cached_file_response(request, path, etag="abc")
+    
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("headers,status,body", [
+    ({"Range": "bytes=10-19"}, 206, DATA[10:20]),
+    ({"Range": "bytes=-5"}, 206, DATA[-5:]),
+    ({"Range": "bytes=5-3"}, 200, DATA),
+    ({"Range": "bytes=0-1,5-6"}, 200, DATA),
+    ({"Range": "bytes=10-19", "If-Range": '"abc"'}, 206, DATA[10:20]),
+    ({"Range": "bytes=10-19", "If-Range": '"stale"'}, 200, DATA),
+])
+async def test_cached_file_response_ranges(client, headers, status, body):
+    async with client:
+        response = await client.get("/file", headers=headers)
+    assert response.status_code == status
+    assert response.content == body
+    if status == 206:
+        assert response.headers["content-range"] == f"bytes {DATA.index(body[0])}-{DATA.index(body[-1])}/100"
+
+
+@pytest.mark.anyio
+async def test_cached_file_response_revalidation(client):
+    async with client:
+        not_modified = await client.get("/file", headers={"If-None-Match": '"abc"'})
+        unsatisfiable = await client.get("/file", headers={"Range": "bytes=200-"})
+    assert not_modified.status_code == 304
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == "bytes */100"
+
+
+@pytest.mark.anyio
+async def test_photo_format_requires_size(db):
+    await db.photos.insert_one({
+        "id": "format-without-size", "filename": "a.jpg", "storage_key": "photos/a.jpg",
+        "width": 4000, "height": 3000, "content_hash": "a" * 64,
+    })
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        response = await client.get('/api/photos/format-without-size/file?format=webp')
+    assert response.status_code == 400
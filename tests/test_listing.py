@@ -0,0 +1,72 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def photo(photo_id, uploaded_at):
+    return server.PhotoMetadata(
+        id=photo_id, filename=f"{photo_id}.jpg", original_filename=f"{photo_id}.jpg",
+        storage_key=f"photos/{photo_id}.jpg", width=1, height=1, size=1, format='JPEG',
+        uploaded_at=uploaded_at,
+    ).model_dump()
+
+
+async def list_all(client, limit):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = await client.get('/api/photos', params=params)
+        assert response.status_code == 200
+        ids.extend(doc['id'] for doc in response.json())
+        cursor = response.headers.get('x-next-cursor')
+        if not cursor:
+            return ids
+
+
+@pytest.fixture
+def client(db):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url='http://test')
+
+
+async def test_pages_split_uploads_with_equal_timestamps(db, client):
+    # Five photos share one timestamp, so page boundaries fall inside the tie
+    docs = [photo(f"p{i}", START) for i in (3, 0, 4, 1, 2)]
+    docs += [photo("early", START - timedelta(seconds=1)), photo("late", START + timedelta(seconds=1))]
+    await db.photos.insert_many(docs)
+    
+    async with client:
+        for limit in (1, 2, 3, 7):
+            assert await list_all(client, limit) == ["early", "p0", "p1", "p2", "p3", "p4", "late"]
+
+
+def test_cursor_round_trip():
+    doc = {"id": "p1", "uploaded_at": START}
+    assert server.decode_cursor(server.encode_cursor(doc)) == (START, "p1")
+
+
+def encoded(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    encoded(5),
+    encoded(["2024-05-01T12:00:00+00:00"]),
+    encoded(["yesterday", "p1"]),
+    encoded([20240501, "p1"]),
+])
+async def test_invalid_cursors_are_rejected(client, cursor):
+    async with client:
+        response = await client.get('/api/photos', params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,61 @@
+import anyio
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def budget():
+    return server.MemoryBudget(capacity=100, request_limit=80, wait_timeout=0.05)
+
+
+async def test_oversized_reservation_is_rejected_with_413(budget):
+    with pytest.raises(HTTPException) as error:
+        await budget.acquire(81)
+    
+    assert error.value.status_code == 413
+    assert (budget.in_use, budget.rejected) == (0, 1)
+
+
+async def test_reservation_that_does_not_fit_in_time_gets_503(budget):
+    await budget.acquire(60)
+    
+    with pytest.raises(HTTPException) as error:
+        await budget.acquire(60)
+    
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "5"
+    assert (budget.in_use, budget.waiting, budget.rejected) == (60, 0, 1)
+
+
+async def test_waiting_reservation_is_admitted_on_release(budget):
+    budget.wait_timeout = 5
+    await budget.acquire(60)
+    
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(budget.acquire, 60)
+        await anyio.wait_all_tasks_blocked()
+        assert budget.waiting == 1
+        budget.release(60)
+    
+    assert (budget.in_use, budget.peak, budget.admitted) == (60, 60, 2)
+
+
+async def test_waiting_without_a_timeout(budget):
+    await budget.acquire(60)
+    
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(lambda: budget.acquire(60, wait=True))
+        await anyio.sleep(0.1)
+        # Well past wait_timeout, and still waiting rather than failed
+        assert (budget.waiting, budget.rejected) == (1, 0)
+        budget.release(60)
+    
+    assert budget.in_use == 60
+
+
+def test_request_limit_never_exceeds_capacity():
+    assert server.MemoryBudget(capacity=100, request_limit=500).request_limit == 100
@@ -0,0 +1,97 @@
+import anyio
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class HeldCollection:
+    """A collection whose lookups read a document, then wait until `release` is set to return it."""
+    
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = 0
+        self.release = anyio.Event()
+    
+    async def find_one(self, query, projection=None):
+        self.queries += 1
+        document = self.documents.get(query["id"])
+        await self.release.wait()
+        return document
+
+
+@pytest.fixture
+def photos(monkeypatch):
+    collection = HeldCollection({"p1": {"id": "p1", "version": 1}})
+    monkeypatch.setattr(server, 'db', {"photos": collection})
+    return collection
+
+
+async def test_concurrent_misses_share_one_query(photos):
+    cache = server.MetadataCache('photos', ttl=30, max_entries=10)
+    results = []
+    
+    async def get():
+        results.append(await cache.get("p1"))
+    
+    async with anyio.create_task_group() as tasks:
+        for _ in range(3):
+            tasks.start_soon(get)
+        await anyio.wait_all_tasks_blocked()
+        photos.release.set()
+    
+    assert results == [{"id": "p1", "version": 1}] * 3
+    assert photos.queries == 1
+    assert (cache.misses, cache.coalesced) == (1, 2)
+    assert await cache.get("p1") == {"id": "p1", "version": 1}
+    assert (photos.queries, cache.hits) == (1, 1)
+
+
+async def test_entries_expire_after_their_ttl(photos):
+    photos.release.set()
+    cache = server.MetadataCache('photos', ttl=0.05, max_entries=10)
+    await cache.get("p1")
+    photos.documents["p1"] = {"id": "p1", "version": 2}
+    
+    assert await cache.get("p1") == {"id": "p1", "version": 1}
+    await anyio.sleep(0.1)
+    assert await cache.get("p1") == {"id": "p1", "version": 2}
+    assert photos.queries == 2
+
+
+async def test_invalidation_during_a_load_is_not_cached(photos):
+    cache = server.MetadataCache('photos', ttl=30, max_entries=10)
+    
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(cache.get, "p1")
+        await anyio.wait_all_tasks_blocked()
+        # The document changes while the old version is being read
+        photos.documents["p1"] = {"id": "p1", "version": 2}
+        cache.invalidate("p1")
+        photos.release.set()
+    
+    assert cache.stats()["entries"] == 0
+    assert await cache.get("p1") == {"id": "p1", "version": 2}
+    assert photos.queries == 2
+
+
+async def test_least_recently_used_entries_are_dropped(photos):
+    photos.release.set()
+    photos.documents.update({"p2": {"id": "p2"}, "p3": {"id": "p3"}})
+    cache = server.MetadataCache('photos', ttl=30, max_entries=2)
+    for doc_id in ("p1", "p2", "p1", "p3"):
+        await cache.get(doc_id)
+    
+    assert photos.queries == 3
+    await cache.get("p2")
+    assert photos.queries == 4
+
+
+async def test_missing_documents_are_not_cached(photos):
+    photos.release.set()
+    cache = server.MetadataCache('photos', ttl=30, max_entries=10)
+    
+    assert await cache.get("missing") is None
+    assert await cache.get("missing") is None
+    assert photos.queries == 2
@@ -0,0 +1,114 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+HASH_A = 'a' * 64
+HASH_B = 'b' * 64
+OLD = time.time() - 7200
+
+
+def store(storage, key, data=b'x', mtime=OLD):
+    path = storage.local_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+
+
+def stored_keys(storage, prefix):
+    return [key for key, _, _ in storage.list(prefix)]
+
+
+def photo_record(photo_id, filename, uploaded_at=None):
+    return {
+        "id": photo_id,
+        "filename": filename,
+        "storage_key": f"photos/{filename}",
+        "uploaded_at": uploaded_at or datetime.now(timezone.utc) - timedelta(hours=2),
+    }
+
+
+def collector(**kwargs):
+    kwargs.setdefault('rate', 0)
+    kwargs.setdefault('max_orphan_fraction', 1)
+    return server.OrphanCollector(**kwargs)
+
+
+@pytest.mark.parametrize("key,stem", [
+    ("photos/abc.jpg", "abc"),
+    ("photos/abc_256.jpg", "abc"),
+    ("photos/abc_2048.webp", "abc"),
+    ("photos/abc_300.jpg", "abc_300"),
+    ("photos/my_photo.jpg", "my_photo"),
+    ("photos/_256.jpg", "_256"),
+])
+def test_photo_file_stem(key, stem):
+    assert server.photo_file_stem(key) == stem
+
+
+async def test_photo_groups_span_batches(db, storage):
+    # With batches of two, each photo's original and renditions straddle batch boundaries
+    for content_hash in (HASH_A, HASH_B):
+        store(storage, f"photos/{content_hash}.jpg")
+        for size in (256, 512):
+            store(storage, f"photos/{content_hash}_{size}.jpg")
+    await db.photos.insert_one(photo_record("kept", f"{HASH_A}.jpg"))
+    
+    report = await collector(batch_size=2).run()
+    
+    assert report["photo_files"] == 3
+    assert stored_keys(storage, server.PHOTO_PREFIX) == [
+        f"photos/{HASH_A}.jpg", f"photos/{HASH_A}_256.jpg", f"photos/{HASH_A}_512.jpg",
+    ]
+
+
+async def test_young_files_are_kept(db, storage):
+    store(storage, f"photos/{HASH_A}.jpg")
+    store(storage, f"photos/{HASH_A}_256.jpg", mtime=time.time())
+    store(storage, f"photos/{HASH_B}.jpg")
+    store(storage, "letterheads/new.png", mtime=time.time())
+    store(storage, "letterheads/old.png")
+    
+    report = await collector(min_age=3600).run()
+    
+    # A photo is only collected once every file in its group is past the cutoff
+    assert report["photo_files"] == 1
+    assert stored_keys(storage, server.PHOTO_PREFIX) == [f"photos/{HASH_A}.jpg", f"photos/{HASH_A}_256.jpg"]
+    assert stored_keys(storage, server.LETTERHEAD_PREFIX) == ["letterheads/new.png"]
+
+
+async def test_young_records_are_kept(db, storage):
+    await db.photos.insert_many([
+        photo_record("old", "old.jpg"),
+        photo_record("new", "new.jpg", uploaded_at=datetime.now(timezone.utc)),
+    ])
+    
+    report = await collector(min_age=3600, delete_records=True).run()
+    
+    assert report["photo_records"] == 1
+    assert await db.photos.distinct("id") == ["new"]
+
+
+async def test_records_are_only_reported_by_default(db, storage):
+    await db.photos.insert_one(photo_record("gone", "gone.jpg"))
+    
+    report = await collector(min_age=0, delete_records=False).run()
+    
+    assert report["photo_records"] == 1
+    assert await db.photos.count_documents({}) == 1
+
+
+async def test_too_many_orphans_aborts_the_category(db, storage):
+    await db.photos.insert_many([photo_record(f"p{i}", f"p{i}.jpg") for i in range(4)])
+    store(storage, "photos/p0.jpg")
+    
+    report = await collector(min_age=0, delete_records=True, max_orphan_fraction=0.5).run()
+    
+    assert report["aborted"] == {"photo_records": 3}
+    assert report["photo_records"] == 0
+    assert await db.photos.count_documents({}) == 4
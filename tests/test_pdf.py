@@ -0,0 +1,154 @@
+import base64
+import io
+import re
+import tempfile
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def photo_record(photo_id):
+    return {"id": photo_id, "storage_key": f"photos/{photo_id}.jpg", "width": 800, "height": 600, "format": 'JPEG'}
+
+
+async def test_book_with_explicit_photos_needs_no_project(db):
+    await db.photos.insert_many([photo_record("p1"), photo_record("p2")])
+    request = server.PDFGenerateRequest(project_id="missing", layout='2x2', photo_ids=["p1", "p2"], book=True)
+    
+    render = await server.prepare_pdf_render(request)
+    
+    assert render["letterhead_key"] is None
+    assert [photo["storage_key"] for photo in render["photos"]] == ["photos/p1.jpg", "photos/p2.jpg"]
+
+
+async def test_book_without_photos_needs_the_project(db):
+    request = server.PDFGenerateRequest(project_id="missing", layout='2x2', book=True)
+    
+    with pytest.raises(HTTPException) as error:
+        await server.prepare_pdf_render(request)
+    assert error.value.status_code == 404
+
+
+def test_bleed_grows_the_media_box_around_the_trimmed_page():
+    output = io.BytesIO()
+    geometry = server.page_geometry('A4', 'portrait', bleed_mm=3)
+    
+    server.render_collage_pdf(output, **geometry)
+    
+    boxes = {
+        name.decode(): [float(value) for value in values.split()]
+        for name, values in re.findall(rb'/(MediaBox|TrimBox|BleedBox) \[([^\]]*)\]', output.getvalue())
+    }
+    width, height = server.A4
+    bleed = 3 / 25.4 * 72
+    media_box = [0, 0, width + 2 * bleed, height + 2 * bleed]
+    assert boxes["TrimBox"] == pytest.approx([bleed, bleed, width + bleed, height + bleed], abs=0.01)
+    assert boxes["MediaBox"] == pytest.approx(media_box, abs=0.01)
+    assert boxes["BleedBox"] == pytest.approx(media_box, abs=0.01)
+
+
+async def test_streamed_pdf_leaves_no_files(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.setattr(server, 'PDF_DIR', tmp_path / 'pdfs')
+    
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        response = await client.post('/api/pdf/generate', json={"project_id": "p", "stream": True})
+    
+    assert response.status_code == 200
+    assert response.content.startswith(b'%PDF')
+    assert list(tmp_path.iterdir()) == []
+
+
+def noise(mode, size=(64, 64)):
+    return Image.effect_noise(size, 60).convert(mode)
+
+
+@pytest.mark.parametrize("img", [
+    noise('L'),
+    noise('RGB'),
+    Image.merge('RGB', [noise('L')] * 3),
+], ids=['grey-L', 'colour-RGB', 'grey-RGB'])
+def test_photos_encode_as_jpeg(img):
+    assert Image.open(io.BytesIO(server.encode_for_pdf(img))).format == 'JPEG'
+
+
+@pytest.mark.parametrize("img", [
+    Image.new('RGB', (64, 64), (200, 30, 30)),
+    Image.new('P', (64, 64)),
+    Image.new('RGBA', (64, 64), (0, 0, 0, 0)),
+], ids=['flat-RGB', 'palette', 'alpha'])
+def test_graphics_stay_lossless(img):
+    assert Image.open(io.BytesIO(server.encode_for_pdf(img))).format == 'PNG'
+
+
+def data_url(img, fmt='PNG'):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt)
+    return f"data:image/{fmt.lower()};base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_data_url_header_reads_the_source_size():
+    header = server.data_url_header(data_url(noise('RGB', (300, 200)), 'JPEG'))
+    assert (header['width'], header['height'], header['format']) == (300, 200, 'JPEG')
+    assert server.data_url_header("data:image/png;base64,bm90IGFuIGltYWdl") is None
+
+
+def test_inline_images_are_estimated_from_their_source():
+    small = {"data": "", "width": 100, "height": 100, "header": {"width": 50, "height": 50, "format": 'PNG'}}
+    large = {**small, "header": {"width": 5000, "height": 5000, "format": 'PNG'}}
+    target = 100 / 72 * 300
+    
+    assert server.estimate_pdf_pixels((1, 1), images=[small], dpi=300) < 3 * target ** 2
+    assert server.estimate_pdf_pixels((1, 1), images=[large], dpi=300) >= 5000 * 5000
+
+
+
+def test_book_estimate_reserves_every_embedded_stream():
+    photos = [photo_record(f"p{index}") for index in range(400)]
+    
+    few = server.estimate_pdf_pixels(server.A4, '2x2', photos[:4], dpi=300)
+    many = server.estimate_pdf_pixels(server.A4, '2x2', photos, dpi=300)
+    
+    slot = server.compute_layout_slots('2x2', *server.A4, server.LETTERHEAD_HEIGHT)[0]
+    tile_width, tile_height = server.pixel_size(slot[2], slot[3], 300)
+    streams = 396 * tile_width * tile_height * server.PDF_STREAM_BYTES_PER_PIXEL / server.BYTES_PER_PIXEL
+    assert many - few == pytest.approx(streams, rel=0.01)
+
+
+
+def test_longest_book_fits_the_default_request_budget():
+    photos = [photo_record(f"p{index}") for index in range(server.PDF_BOOK_MAX_PHOTOS)]
+    
+    assert server.estimate_pdf_pixels(server.A4, '2x2', photos, dpi=300) <= 200_000_000
+
+
+async def test_book_over_the_memory_budget_is_rejected(db):
+    await db.photos.insert_many([photo_record(f"p{index}") for index in range(300)])
+    request = {"project_id": "p", "layout": '2x2', "photo_ids": [f"p{index}" for index in range(300)],
+               "book": True, "dpi": 1200}
+    
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        response = await client.post('/api/pdf/jobs', json=request)
+    assert response.status_code == 413
+    assert await db.pdf_jobs.count_documents({}) == 0
+
+@pytest.mark.parametrize("edits", [
+    [{"operation": "rotate", "value": 90}],
+    [{"operation": "rotate", "value": 270}, {"operation": "grayscale"}],
+    [{"operation": "rotate", "value": 45}],
+], ids=['quarter-turn', 'three-quarter-turn', 'oblique'])
+def test_rotated_photos_decode_for_their_edited_orientation(tmp_path, edits):
+    path = tmp_path / 'wide.jpg'
+    noise('RGB', (800, 200)).save(path, 'JPEG')
+    
+    img = server.load_edited_image(path, edits, (200, 50))
+    
+    assert img.width >= 200 and img.height >= 50
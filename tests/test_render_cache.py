@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+
+
+def disk_usage(directory):
+    return sum(path.stat().st_size for path in directory.glob('*/*'))
+
+
+def test_overwriting_a_key_is_counted_once(tmp_path):
+    cache = server.RenderCache(tmp_path, memory_bytes=0, disk_bytes=10_000)
+    key = cache.make_key('tile', 1)
+    cache.put(cache.make_key('tile', 0), b'x' * 10)
+    cache.put(key, b'x' * 100)
+    cache.put(key, b'y' * 60)
+    
+    assert cache.stats()["disk_bytes"] == 70 == disk_usage(tmp_path)
+
+
+def test_concurrent_puts_stay_within_the_disk_budget(tmp_path):
+    cache = server.RenderCache(tmp_path, memory_bytes=0, disk_bytes=2_000)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: cache.put(cache.make_key('tile', i), b'x' * 100), range(200)))
+    
+    assert disk_usage(tmp_path) <= 2_000
+    assert cache.get(cache.make_key('tile', 199)) == b'x' * 100
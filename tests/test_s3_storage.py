@@ -0,0 +1,189 @@
+import io
+import os
+import types
+from datetime import datetime, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+
+import storage_backends
+
+
+class FakeS3:
+    """Enough of a boto3 S3 client for S3Storage, backed by a dict of key -> (bytes, content type)."""
+    
+    def __init__(self, objects, endpoint_url, config):
+        self.objects = objects
+        self.endpoint_url = endpoint_url
+        self.config = config
+    
+    @staticmethod
+    def _missing(code, operation):
+        return ClientError({"Error": {"Code": code}}, operation)
+    
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with open(filename, 'rb') as f:
+            self.objects[key] = (f.read(), (ExtraArgs or {}).get("ContentType"))
+    
+    def download_file(self, bucket, key, filename):
+        if key not in self.objects:
+            raise self._missing('404', 'HeadObject')
+        with open(filename, 'wb') as f:
+            f.write(self.objects[key][0])
+    
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self._missing('404', 'HeadObject')
+        return {"ContentLength": len(self.objects[Key][0])}
+    
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self._missing('NoSuchKey', 'GetObject')
+        return {"Body": io.BytesIO(self.objects[Key][0])}
+    
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete["Objects"]:
+            self.objects.pop(item["Key"], None)
+    
+    def get_paginator(self, operation):
+        objects = self.objects
+        
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                keys = sorted(key for key in objects if key.startswith(Prefix))
+                modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+                # Two keys per page, so listings have to follow pages
+                for start in range(0, len(keys), 2):
+                    yield {"Contents": [
+                        {"Key": key, "Size": len(objects[key][0]), "LastModified": modified}
+                        for key in keys[start:start + 2]
+                    ]}
+        
+        return Paginator()
+    
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        query = "&".join(f"{name}={value}" for name, value in sorted(Params.items()) if name not in ("Bucket", "Key"))
+        return f"{self.endpoint_url}/{Params['Bucket']}/{Params['Key']}?{query}&expires={ExpiresIn}"
+
+
+@pytest.fixture
+def objects(monkeypatch):
+    stored = {}
+    
+    def client(service, endpoint_url=None, region_name=None, config=None):
+        return FakeS3(stored, endpoint_url, config)
+    
+    monkeypatch.setattr(storage_backends, 'boto3', types.SimpleNamespace(client=client))
+    return stored
+
+
+@pytest.fixture
+def s3(objects, tmp_path):
+    return storage_backends.S3Storage(
+        'bucket', tmp_path / 'cache', prefix='tenant/', endpoint_url='http://minio:9000',
+        public_endpoint_url='https://files.example.com', presign_expiry=600,
+    )
+
+
+def upload(s3, tmp_path, key, data):
+    source = tmp_path / f"upload-{len(data)}-{key.replace('/', '-')}"
+    source.write_bytes(data)
+    s3.put_file(key, source)
+    return source
+
+
+def test_objects_are_stored_under_the_prefix(s3, objects, tmp_path):
+    source = upload(s3, tmp_path, 'photos/a.jpg', b'jpeg bytes')
+    
+    assert objects == {'tenant/photos/a.jpg': (b'jpeg bytes', 'image/jpeg')}
+    assert s3.exists('photos/a.jpg')
+    assert s3.open('photos/a.jpg').read() == b'jpeg bytes'
+    # The upload is kept as the cached copy
+    assert not source.exists()
+    assert s3.local_path('photos/a.jpg').read_bytes() == b'jpeg bytes'
+
+
+def test_listing_strips_the_prefix_across_pages(s3, tmp_path):
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        upload(s3, tmp_path, f'photos/{name}', name.encode())
+    upload(s3, tmp_path, 'pdfs/x.pdf', b'pdf')
+    
+    listed = list(s3.list('photos'))
+    
+    assert [key for key, _, _ in listed] == ['photos/a.jpg', 'photos/b.jpg', 'photos/c.jpg']
+    assert listed[0][1:] == (5, datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+def test_missing_objects(s3):
+    assert not s3.exists('photos/missing.jpg')
+    with pytest.raises(FileNotFoundError):
+        s3.open('photos/missing.jpg')
+    with pytest.raises(FileNotFoundError):
+        s3.local_path('photos/missing.jpg')
+    # A failed download leaves no partial file behind
+    assert list((s3.cache_dir / 'photos').iterdir()) == []
+
+
+def test_objects_are_downloaded_into_the_cache_once(s3, objects):
+    objects['tenant/photos/b.jpg'] = (b'stored elsewhere', 'image/jpeg')
+    
+    path = s3.local_path('photos/b.jpg')
+    del objects['tenant/photos/b.jpg']
+    
+    assert path.read_bytes() == b'stored elsewhere'
+    assert s3.local_path('photos/b.jpg') == path
+
+
+def test_download_urls_are_presigned_for_the_public_endpoint(s3):
+    url = s3.download_url(
+        'pdfs/x.pdf', media_type='application/pdf', filename='collage.pdf', cache_control='no-store'
+    )
+    
+    assert url.startswith('https://files.example.com/bucket/tenant/pdfs/x.pdf?')
+    assert 'ResponseContentType=application/pdf' in url
+    assert 'ResponseContentDisposition=attachment; filename="collage.pdf"' in url
+    assert 'ResponseCacheControl=no-store' in url
+    assert url.endswith('expires=600')
+    # Presigning uses its own client, path-style like the internal one
+    clients = {client.endpoint_url: client for client in s3._clients.values()}
+    assert set(clients) == {'https://files.example.com'}
+    assert clients['https://files.example.com'].config.s3 == {'addressing_style': 'path'}
+
+
+def test_delete_removes_objects_and_cached_copies(s3, objects, tmp_path):
+    upload(s3, tmp_path, 'photos/a.jpg', b'a')
+    upload(s3, tmp_path, 'photos/b.jpg', b'b')
+    
+    s3.delete('photos/a.jpg', 'photos/missing.jpg')
+    
+    assert list(objects) == ['tenant/photos/b.jpg']
+    assert not (s3.cache_dir / 'photos' / 'a.jpg').exists()
+
+
+def test_cache_is_trimmed_least_recently_used_first(s3, tmp_path):
+    s3.cache_bytes = 250
+    for age, name in enumerate(('new', 'middle', 'old')):
+        upload(s3, tmp_path, f'photos/{name}.jpg', b'x' * 100)
+        os.utime(s3.cache_dir / 'photos' / f'{name}.jpg', (1000 - age, 1000 - age))
+    download = s3.cache_dir / 'photos' / '.in-flight.part'
+    download.write_bytes(b'x' * 100)
+    os.utime(download, (1, 1))
+    
+    assert s3.trim_cache() == 100
+    
+    assert sorted(path.name for path in (s3.cache_dir / 'photos').iterdir()) == [
+        '.in-flight.part', 'middle.jpg', 'new.jpg'
+    ]
+
+
+def test_s3_backend_is_selected_from_the_environment(objects, monkeypatch, tmp_path):
+    monkeypatch.setenv('STORAGE_BACKEND', 's3')
+    monkeypatch.setenv('S3_BUCKET', 'collages')
+    monkeypatch.setenv('S3_PREFIX', 'prod/')
+    monkeypatch.setenv('STORAGE_CACHE_MB', '1')
+    
+    storage = storage_backends.create_storage(tmp_path / 'uploads', tmp_path / 'cache')
+    
+    assert isinstance(storage, storage_backends.S3Storage)
+    assert (storage.bucket, storage.prefix, storage.cache_bytes) == ('collages', 'prod/', 1024 * 1024)
+    assert storage.cache_dir == tmp_path / 'cache'
@@ -0,0 +1,98 @@
+import anyio
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def stored_photo(storage, tmp_path, content_hash, data):
+    upload = tmp_path / f".{content_hash}.part"
+    upload.write_bytes(data)
+    filename = f"{content_hash}.jpg"
+    await server.store_photo_blob(upload, content_hash, filename, len(data))
+    photo = server.PhotoMetadata(
+        filename=filename, original_filename=filename, storage_key=f"photos/{filename}",
+        width=1, height=1, size=len(data), format='JPEG', content_hash=content_hash,
+    )
+    return server.PhotoUploadResult(filename=filename, photo=photo)
+
+
+async def test_failed_inserts_are_released_and_reported(db, storage, tmp_path):
+    saved = await stored_photo(storage, tmp_path, 'a' * 64, b'first')
+    rejected = await stored_photo(storage, tmp_path, 'b' * 64, b'second')
+    skipped = server.PhotoUploadResult(filename='bad.jpg', error='Invalid image file')
+    await db.photos.create_index("id", unique=True)
+    await db.photos.insert_one({"id": rejected.photo.id})
+    rejected_key = rejected.photo.storage_key
+    
+    photos = await server.insert_photo_results([saved, rejected, skipped])
+    
+    assert [photo.id for photo in photos] == [saved.photo.id]
+    assert rejected.photo is None and rejected.error
+    assert skipped.error == 'Invalid image file'
+    assert storage.exists(saved.photo.storage_key)
+    assert not storage.exists(rejected_key)
+    assert await db.photo_blobs.distinct("hash") == ['a' * 64]
+
+
+
+async def test_upload_during_last_release_keeps_its_file(db, storage, tmp_path, monkeypatch):
+    content_hash = 'c' * 64
+    released = await stored_photo(storage, tmp_path, content_hash, b'content')
+    key = released.photo.storage_key
+    deleting, resume = anyio.Event(), anyio.Event()
+    delete_photo_files = server.delete_photo_files
+    
+    async def paused_delete(*filenames):
+        deleting.set()
+        await resume.wait()
+        await delete_photo_files(*filenames)
+    
+    monkeypatch.setattr(server, 'delete_photo_files', paused_delete)
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(server.release_photo_blob, released.photo.model_dump())
+        await deleting.wait()
+        # The upload takes its reference after the release has tombstoned the blob
+        tasks.start_soon(stored_photo, storage, tmp_path, content_hash, b'content')
+        while (await db.photo_blobs.find_one({"hash": content_hash}))['ref_count'] < 1:
+            await anyio.sleep(0.01)
+        resume.set()
+    
+    assert storage.exists(key)
+    blob = await db.photo_blobs.find_one({"hash": content_hash}, {"_id": 0, "ref_count": 1, "deleting": 1})
+    assert blob == {"ref_count": 1}
+
+
+async def test_last_release_deletes_blob(db, storage, tmp_path):
+    released = await stored_photo(storage, tmp_path, 'd' * 64, b'content')
+    
+    await server.release_photo_blob(released.photo.model_dump())
+    
+    assert not storage.exists(released.photo.storage_key)
+    assert await db.photo_blobs.count_documents({}) == 0
+
+async def test_import_into_missing_project_is_rejected(db, storage):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        response = await client.post(
+            '/api/photos/import?project_id=missing',
+            files={'file': ('photos.zip', b'not read', 'application/zip')},
+        )
+    assert response.status_code == 404
+    assert await db.photos.count_documents({}) == 0
+
+
+async def test_oversized_letterhead_is_rejected(db, storage, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, 'MAX_UPLOAD_BYTES', 10)
+    monkeypatch.setattr(server, 'LETTERHEAD_DIR', tmp_path)
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        response = await client.post(
+            '/api/letterheads/upload?name=big',
+            files={'file': ('big.png', b'x' * 100, 'image/png')},
+        )
+    assert response.status_code == 413
+    assert await db.letterheads.count_documents({}) == 0
+    assert list(tmp_path.iterdir()) == []
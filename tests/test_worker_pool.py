@@ -0,0 +1,110 @@
+import threading
+
+import anyio
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    memory = server.MemoryBudget(capacity=1000 * server.BYTES_PER_PIXEL, request_limit=1000 * server.BYTES_PER_PIXEL)
+    monkeypatch.setattr(server, 'memory_budget', memory)
+    return memory
+
+
+@pytest.fixture
+def pool():
+    pool = server.WorkerPool('thread', size=1, queue_limit=1, timeout=5)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture
+def gate():
+    """An event that blocking jobs wait on; always released at teardown."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+async def settled(pool):
+    """Wait for finished jobs to hand back their slot and memory."""
+    with anyio.fail_after(5):
+        while pool.pending:
+            await anyio.sleep(0.01)
+        await anyio.sleep(0.01)
+
+
+async def test_full_queue_is_rejected_with_429(pool, budget, gate):
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(pool.run, gate.wait)
+        await anyio.wait_all_tasks_blocked()
+        
+        with pytest.raises(HTTPException) as error:
+            await pool.run(sum, [1, 2])
+        assert error.value.status_code == 429
+        assert error.value.headers["Retry-After"] == "1"
+        gate.set()
+    
+    assert (pool.rejected, pool.completed) == (1, 1)
+
+
+async def test_waiting_callers_queue_for_a_slot(pool, budget, gate):
+    results = []
+    
+    async def run_waiting():
+        results.append(await pool.run(sum, [1, 2], wait=True))
+    
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(pool.run, gate.wait)
+        await anyio.wait_all_tasks_blocked()
+        tasks.start_soon(run_waiting)
+        await anyio.wait_all_tasks_blocked()
+        assert pool.waiting == 1 and results == []
+        gate.set()
+    
+    assert results == [3]
+    assert pool.rejected == 0
+
+
+async def test_timed_out_job_holds_its_slot_and_memory_until_it_finishes(budget, gate):
+    pool = server.WorkerPool('thread', size=1, queue_limit=2, timeout=0.05)
+    try:
+        with pytest.raises(HTTPException) as error:
+            await pool.run(gate.wait, pixels=400)
+        assert error.value.status_code == 504
+        assert pool.timed_out == 1
+        # The thread is still busy, so its slot and reservation stay taken
+        assert pool.pending == 1
+        assert budget.in_use == 400 * server.BYTES_PER_PIXEL
+        
+        gate.set()
+        await settled(pool)
+        assert budget.in_use == 0
+    finally:
+        pool.shutdown()
+
+
+async def test_memory_is_released_when_a_job_fails(pool, budget):
+    def fail():
+        raise ValueError("broken image")
+    
+    with pytest.raises(ValueError):
+        await pool.run(fail, pixels=400)
+    await settled(pool)
+    
+    assert budget.in_use == 0
+    assert budget.admitted == 1
+
+
+async def test_rejected_reservations_give_back_their_slot(pool, budget):
+    with pytest.raises(HTTPException) as error:
+        await pool.run(sum, [1], pixels=2000)
+    
+    assert error.value.status_code == 413
+    assert pool.pending == 0
+    assert budget.in_use == 0